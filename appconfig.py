@@ -1,5 +1,6 @@
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Optional
 
 
 class Settings(BaseSettings):
@@ -8,8 +9,31 @@ class Settings(BaseSettings):
     )
 
     DATABASE_URL: str
+    # Read replicas (postgresql+asyncpg://...), as a JSON list; the list routes read from them when healthy
+    DATABASE_REPLICA_URLS: list[str] = []
+    REPLICA_CHECK_INTERVAL: int = 10
+    REPLICA_MAX_LAG: int = 30
+    # Prepared statements kept per connection. By default the cache grows with the distinct statements run by
+    # the worker, up to 5 per filter template (pages by offset, by cursor and with a window count, count and
+    # EXPLAIN) of every route. 0 disables the cache
+    DB_STATEMENT_CACHE_SIZE: Optional[int] = None
+    # Behind PgBouncer in transaction mode (1.21+, with max_prepared_statements) the statements get unique names
+    DB_PGBOUNCER: bool = False
     CACHE_SERVER_URL: str        
-    CACHE_TTL: str = "30m"      
+    CACHE_TTL: str = "6h"      
+    CACHE_SOFT_TTL: str = "30m"
+    CACHE_LOCAL_SIZE: int = 1000
+    CACHE_LOCAL_TTL: str = "1m"
+    # Circuit breaker of the cache server: opens when the error (or slow call) rate of the last
+    # CACHE_BREAKER_WINDOW calls reaches CACHE_BREAKER_ERROR_RATE, and probes again after CACHE_BREAKER_COOLDOWN seconds
+    CACHE_BREAKER_WINDOW: int = 50
+    CACHE_BREAKER_MIN_CALLS: int = 10
+    CACHE_BREAKER_ERROR_RATE: float = 0.5
+    CACHE_BREAKER_SLOW_CALL: float = 0.25
+    CACHE_BREAKER_TIMEOUT: float = 1.0
+    CACHE_BREAKER_COOLDOWN: int = 30
+    # Seconds between each worker's flushes of its request stats to the shared store
+    STATS_FLUSH_INTERVAL: float = 1.0
     APP_NAME: str
     APP_DESCRIPTION: str
     APP_TAGS: list = [
@@ -68,7 +92,32 @@ class Settings(BaseSettings):
     ]
     DEFAULT_PAGE_SIZE: int = 100
     MAX_PAGE_SIZE: int = 200
+    COUNT_CACHE_TTL: str = "6h"
+    DATA_VERSION_INTERVAL: int = 30
+    WARMUP_TOP_N: int = 50
+    WARMUP_CONCURRENCY: int = 2
+    WARMUP_SAVE_INTERVAL: int = 300
+    WARMUP_LOCK_TTL: int = 600
+    # Every WARMUP_DECAY_INTERVAL seconds the stored query counts are multiplied by WARMUP_DECAY
+    WARMUP_DECAY_INTERVAL: int = 3600
+    WARMUP_DECAY: float = 0.5
+    COUNT_ESTIMATE_THRESHOLD: int = 100000
+    # How the exact count and the page are fetched: "auto", "sequential", "concurrent" (two connections)
+    # or "window" (count(*) OVER () in the page query). "auto" uses the window up to WINDOW_COUNT_MAX_ROWS estimated rows
+    COUNT_STRATEGY: str = "auto"
+    WINDOW_COUNT_MAX_ROWS: int = 5000
+    EXPORT_BATCH_SIZE: int = 5000
+    CREATE_SEARCH_INDEXES: bool = True
+    FILTER_TEMPLATE_CACHE_SIZE: int = 256
+    MAX_FILTER_IDS: int = 1000
+    # Children loaded per relation and level by the expand parameter
+    MAX_EXPAND_CHILDREN: int = 10000
     ERROR_MESSAGE_NO_PARAMS: str = "Nenhum parâmetro de consulta foi informado."
     ERROR_MESSAGE_INTERNAL: str = "Erro Interno Inesperado."
+    ERROR_MESSAGE_INVALID_CURSOR: str = "Cursor de paginação inválido."
+    ERROR_MESSAGE_INVALID_EXPAND: str = "Relacionamento inválido no parâmetro expand:"
+    ERROR_MESSAGE_EXPAND_TOO_LARGE: str = "Registros relacionados demais; reduza o tamanho da página para incluir:"
+    ERROR_MESSAGE_INVALID_ID_LIST: str = "Lista de identificadores inválida no parâmetro:"
+    ERROR_MESSAGE_INVALID_DATE: str = "Data inválida no parâmetro:"
     STATS_USER: str 
     STATS_PASSWORD: str 
\ No newline at end of file
@@ -0,0 +1,88 @@
+# benchmarks/count_strategies.py
+"""
+Compara, por endpoint, a latência da contagem exata junto com a primeira página em cada estratégia:
+sequencial (COUNT e página na mesma conexão), concorrente (duas conexões do pool ao mesmo tempo)
+e janela (count(*) OVER () na própria consulta da página). Sem filtros e sem o cache de contagens.
+
+Uso: DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.count_strategies [repeticoes]
+"""
+import asyncio
+import importlib
+import pkgutil
+import statistics
+import sys
+import time
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from appconfig import Settings
+from src import routers
+from src.counts import count_statement
+from src.database import create_engine
+from src.filters import FilterSet
+from src.utils import page_statement
+
+PAGE_PARAMS = {"page_limit": Settings().DEFAULT_PAGE_SIZE, "page_offset": 0}
+
+
+async def sequential(session_maker, query, params):
+    async with session_maker() as session:
+        await session.scalar(count_statement(query), params)
+        await session.execute(page_statement(query, False), {**params, **PAGE_PARAMS})
+
+
+async def concurrent(session_maker, query, params):
+    async def count():
+        async with session_maker() as session:
+            await session.scalar(count_statement(query), params)
+
+    async def page():
+        async with session_maker() as session:
+            await session.execute(page_statement(query, False), {**params, **PAGE_PARAMS})
+
+    await asyncio.gather(count(), page())
+
+
+async def window(session_maker, query, params):
+    async with session_maker() as session:
+        await session.execute(page_statement(query, False, True), {**params, **PAGE_PARAMS})
+
+
+async def time_strategy(strategy, session_maker, query, params, repeat: int) -> float:
+    # The first run warms the pool and the prepared statements
+    await strategy(session_maker, query, params)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await strategy(session_maker, query, params)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def endpoint_filters() -> dict:
+    filter_sets = {}
+    for module_info in pkgutil.iter_modules(routers.__path__):
+        module = importlib.import_module(f"{routers.__name__}.{module_info.name}")
+        for name, value in vars(module).items():
+            if isinstance(value, FilterSet):
+                filter_sets[module_info.name] = value
+    return filter_sets
+
+
+async def main(repeat: int):
+    # The routes are imported first, since their FilterSets size the prepared statement caches
+    filter_sets = endpoint_filters()
+    engine = create_engine(Settings().DATABASE_URL)
+    session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    print(f"Mediana de {repeat} execuções (ms)")
+    print(f"{'endpoint':<30}{'sequencial':>12}{'concorrente':>13}{'janela':>10}")
+    try:
+        for endpoint, filter_set in sorted(filter_sets.items()):
+            query, params = filter_set.query({})
+            results = [await time_strategy(strategy, session_maker, query, params, repeat)
+                       for strategy in (sequential, concurrent, window)]
+            print(f"{endpoint:<30}{results[0]:>12.1f}{results[1]:>13.1f}{results[2]:>10.1f}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
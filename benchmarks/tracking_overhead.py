@@ -0,0 +1,80 @@
+# benchmarks/tracking_overhead.py
+"""
+Mede o custo por requisição do registro de estatísticas: sem middleware, com o middleware HTTP
+anterior (BaseHTTPMiddleware, datetime.now + strftime a cada requisição) e com o middleware ASGI atual.
+As requisições são feitas direto na aplicação ASGI, sem rede, a uma rota que só devolve um texto.
+
+Uso: python -m benchmarks.tracking_overhead [requisicoes]
+(as variáveis de ambiente exigidas por appconfig.Settings precisam estar definidas)
+"""
+import asyncio
+import datetime as dt
+import statistics
+import sys
+import time
+from collections import Counter
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from src.tracking import RequestTrackingMiddleware
+
+REPEAT = 5
+
+
+def build_app(middleware: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return PlainTextResponse("pong")
+
+    if middleware == "http":
+        legacy_stats = Counter()
+
+        @app.middleware("http")
+        async def track_requests(request: Request, call_next):
+            start_time = time.time()
+            response = await call_next(request)
+            process_time = time.time() - start_time
+            _path = request.url.path
+            _curr_month = dt.datetime.now(tz=dt.timezone(dt.timedelta(hours=-3))).strftime("%m/%Y")
+            legacy_stats[_curr_month] += 1
+            legacy_stats[(_path, "count")] += 1
+            legacy_stats[(_path, "total_time")] += process_time
+            return response
+    elif middleware == "asgi":
+        app.add_middleware(RequestTrackingMiddleware)
+    return app
+
+
+async def time_requests(app, requests: int) -> float:
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/ping", "raw_path": b"/ping", "root_path": "", "query_string": b"", "headers": [],
+             "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    # The first request builds the middleware stack and the route matcher
+    await app(dict(scope), receive, send)
+    start = time.perf_counter_ns()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter_ns() - start) / requests / 1000
+
+
+async def main(requests: int):
+    results = {}
+    for middleware in ("none", "http", "asgi"):
+        app = build_app(middleware)
+        results[middleware] = statistics.median([await time_requests(app, requests) for _ in range(REPEAT)])
+    print(f"{requests} requisições, mediana de {REPEAT} rodadas (µs por requisição)")
+    print(f"  sem middleware:         {results['none']:8.1f}")
+    print(f"  BaseHTTPMiddleware:     {results['http']:8.1f}  (+{results['http'] - results['none']:.1f})")
+    print(f"  middleware ASGI:        {results['asgi']:8.1f}  (+{results['asgi'] - results['none']:.1f})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,60 @@
+# benchmarks/trgm_search.py
+"""
+Compara a latência de um filtro ILIKE '%x%' com varredura sequencial e com índice GIN (pg_trgm).
+Cria uma tabela temporária num schema próprio, popula com dados sintéticos e remove tudo ao final.
+
+Uso: DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.trgm_search [linhas]
+"""
+import asyncio
+import statistics
+import sys
+import time
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from appconfig import Settings
+
+SCHEMA = "bench_trgm"
+REPEAT = 20
+PATTERNS = ("%a1b2%", "%ffe%", "%0c0c0%")
+
+
+async def time_queries(conn) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        for pattern in PATTERNS:
+            start = time.perf_counter()
+            await conn.execute(text(f"SELECT id FROM {SCHEMA}.busca WHERE texto ILIKE :p LIMIT 100"), {"p": pattern})
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def main(rows: int):
+    engine = create_async_engine(Settings().DATABASE_URL)
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        try:
+            await conn.execute(text(f"CREATE TABLE {SCHEMA}.busca (id int PRIMARY KEY, texto text)"))
+            await conn.execute(text(
+                f"INSERT INTO {SCHEMA}.busca SELECT g, md5(g::text) || ' ' || md5((g * 7)::text) "
+                "FROM generate_series(1, :rows) g"), {"rows": rows})
+            await conn.execute(text(f"ANALYZE {SCHEMA}.busca"))
+            seq_scan = await time_queries(conn)
+
+            await conn.execute(text(f"CREATE INDEX ON {SCHEMA}.busca USING gin (texto gin_trgm_ops)"))
+            await conn.execute(text(f"ANALYZE {SCHEMA}.busca"))
+            gin_index = await time_queries(conn)
+
+            print(f"linhas: {rows}")
+            print(f"varredura sequencial (mediana): {seq_scan:.2f} ms")
+            print(f"índice GIN pg_trgm (mediana):   {gin_index:.2f} ms")
+            print(f"ganho: {seq_scan / gin_index:.1f}x")
+        finally:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000))
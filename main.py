@@ -1,30 +1,39 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, status, Depends, WebSocket
+from fastapi import FastAPI, status, Depends, WebSocket
 from fastapi.websockets import WebSocketDisconnect
 import orjson
-from fastapi.responses import RedirectResponse, ORJSONResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, ORJSONResponse, HTMLResponse, PlainTextResponse
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.staticfiles import StaticFiles
 import logging
-from cashews.contrib.fastapi import (
-    CacheEtagMiddleware,
-    CacheRequestControlMiddleware    
-)
-from collections import defaultdict
+from cashews.contrib.fastapi import CacheRequestControlMiddleware
 from src.database import Database
-from src.cache import setup_cache
+from src.cache import setup_cache, tier_stats, key_stats, breaker_stats
+from src.versions import watch_data_versions
+from src.tracking import RequestTrackingMiddleware
+from src.warmup import (
+    setup_warmup,
+    save_signatures,
+    save_signatures_periodically,
+    warm_cache
+)
+from src.broadcast import Broadcaster
+from src.metrics import collect_metrics, render_metrics, watch_event_loop_lag
+from src.stats import (
+    setup_stats,
+    flush_stats,
+    flush_stats_periodically,
+    read_stats,
+    read_monthly_stats
+)
 from src.utils import (
-    reset_minute_counters, 
     verify_admin, 
     config, 
-    save_stats,
-    get_allowed_stats_paths
+    save_stats
 )
 import asyncio
 import psutil
-import json
 import time
-import datetime as dt
 
 
 # Importando Rotas
@@ -51,44 +60,37 @@ logger = logging.getLogger(__name__)
 db = Database()
 # Set root path const
 ROOTPATH = "/api-ted"
-# Initialize a dictionary to store request counts and timings
-request_stats = defaultdict(lambda: {"count": 0, "total_time": 0, "last_minute_count": 0, "up_time": 0})
-monthly_stats = defaultdict(int)
-# Initialize allowed_stats_paths with a default set of paths
-# These will be updated after the server is running
-allowed_stats_paths = []
-
-
-# Background task to update allowed paths
-async def update_allowed_paths(logger):
-    try:
-        global allowed_stats_paths
-        new_paths = await get_allowed_stats_paths(root_path=ROOTPATH, logger=logger)
-        if new_paths:
-            allowed_stats_paths = new_paths
-            logger.info(f"Updated allowed stats paths: {allowed_stats_paths}")
-    except Exception as e:
-        logger.error(f"Error updating allowed paths: {str(e)}")
+# Start of this worker, shown in the stats page. Request counts and timings are kept in src.stats, shared by all workers
+app_uptime = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # load before the app starts
     logger.info("Iniciando aplicação...")
-    global allowed_stats_paths
+    global app_uptime
     try:
         # Inicializa o Banco de Dados
         await db.init_db()        
         # Configure o cache
         setup_cache(config)
-        # background task to Update allowed paths for stats
-        update_paths_task = asyncio.create_task(update_allowed_paths(logger))
-        # background task to reset the "last minute" counters every 60 seconds.
-        reset_task = asyncio.create_task(reset_minute_counters(request_stats))
-        save_task = asyncio.create_task(save_stats(monthly_stats))
+        setup_stats(config)
+        setup_warmup(config)
+        # background task to follow the data version of the tables, which invalidates the cache after each load
+        versions_task = asyncio.create_task(watch_data_versions(db, logger))
+        # background task to check the health and latency of the read replicas
+        replicas_task = asyncio.create_task(db.watch_replicas(config.REPLICA_CHECK_INTERVAL, config.REPLICA_MAX_LAG))
+        # background tasks to replay the most frequent queries after startup and after each load
+        warmup_task = asyncio.create_task(warm_cache(app, logger))
+        signatures_task = asyncio.create_task(save_signatures_periodically(logger))
+        # background task to send the request stats of this worker to the shared store
+        flush_task = asyncio.create_task(flush_stats_periodically(config.STATS_FLUSH_INTERVAL, logger,
+                                                                  collect=lambda: collect_metrics(db)))
+        loop_lag_task = asyncio.create_task(watch_event_loop_lag())
+        save_task = asyncio.create_task(save_stats(read_monthly_stats))
         # setting app uptime with timezone offset
         _app_uptime = time.time() - 3*3600
-        request_stats["/"]["up_time"] = time.strftime("%d/%m/%Y %H:%M", time.localtime(_app_uptime))
+        app_uptime = time.strftime("%d/%m/%Y %H:%M", time.localtime(_app_uptime))
         logger.info("Aplicação iniciada com sucesso!")
     except Exception as e:
         logger.error(f"Erro na inicialização: {str(e)}")
@@ -96,14 +98,26 @@ async def lifespan(app: FastAPI):
     yield
     # load after the app has finished
     # Shutdown: Cancel the background task
-    update_paths_task.cancel()
-    reset_task.cancel()
+    versions_task.cancel()
+    replicas_task.cancel()
+    warmup_task.cancel()
+    signatures_task.cancel()
+    try:
+        await save_signatures()
+    except Exception as e:
+        logger.error(f"Erro ao salvar as consultas mais frequentes: {str(e)}")
+    flush_task.cancel()
+    loop_lag_task.cancel()
     save_task.cancel()
     try:
-        await reset_task
+        await flush_task
         await save_task
     except asyncio.CancelledError:
         pass
+    try:
+        await flush_stats()
+    except Exception as e:
+        logger.error(f"Erro ao gravar as estatísticas: {str(e)}")
     
 
 app = FastAPI(lifespan=lifespan, 
@@ -119,32 +133,8 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount(f"{ROOTPATH}/static", StaticFiles(directory="static"), name="static_prefixed")
 
 # Incluindo Middlewares
-app.add_middleware(CacheEtagMiddleware)
 app.add_middleware(CacheRequestControlMiddleware)
-
-
-@app.middleware("http")
-async def track_requests(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-
-    # Update stats
-    _path = request.url.path
-    
-    # If allowed_stats_paths is empty, track all paths
-    # Otherwise, only track paths in the allowed list
-    if allowed_stats_paths and _path not in allowed_stats_paths:
-        return response
-    
-    _curr_date = dt.datetime.now(tz=dt.timezone(dt.timedelta(hours=-3)))
-    _curr_month = _curr_date.strftime("%m/%Y")
-    monthly_stats[_curr_month] += 1
-    request_stats[_path]["count"] += 1
-    request_stats[_path]["total_time"] += process_time
-    request_stats[_path]["last_minute_count"] += 1
-    
-    return response
+app.add_middleware(RequestTrackingMiddleware, root_path=ROOTPATH)
 
 
 # Incluindo Rotas
@@ -182,7 +172,7 @@ async def get_stats(username: str = Depends(verify_admin)):
     cpu_percent = psutil.cpu_percent()
     memory_percent = psutil.virtual_memory().percent
     disk_percent = psutil.disk_usage('/').percent
-    app_uptime = request_stats["/"]["up_time"]
+    request_stats, _ = await read_stats()
     html_content = f"""
         <html>
             <head>
@@ -249,16 +239,15 @@ async def get_stats(username: str = Depends(verify_admin)):
                             <th>Total Requests</th>
                             <th>Requests/Minute</th>
                             <th>Avg Response Time (ms)</th>
+                            <th>p50 (ms)</th>
+                            <th>p95 (ms)</th>
+                            <th>p99 (ms)</th>
                         </tr>
                     </thead>
                     <tbody>
         """
 
     for _path, stats in request_stats.items():   
-        # If allowed_stats_paths is empty, show all paths
-        # Otherwise, only show paths in the allowed list
-        if allowed_stats_paths and _path not in allowed_stats_paths:
-            continue     
         avg_time = stats["total_time"] / stats["count"] if stats["count"] > 0 else 0
         _endpoint = _path.split('/')[-1]
         html_content += f"""
@@ -267,6 +256,9 @@ async def get_stats(username: str = Depends(verify_admin)):
                     <td>{stats['count']}</td>
                     <td>{stats['last_minute_count']}</td>
                     <td>{avg_time * 1000:.2f}</td>
+                    <td>{stats['p50']:.2f}</td>
+                    <td>{stats['p95']:.2f}</td>
+                    <td>{stats['p99']:.2f}</td>
                 </tr>
         """
 
@@ -296,6 +288,37 @@ async def get_stats(username: str = Depends(verify_admin)):
                     </tr>
                 </tbody>
             </table>
+            <h2>Cache</h2>
+            <table id="cacheStats">
+                <thead>
+                    <tr>
+                        <th>Tier</th>
+                        <th>Hits</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    <tr>
+                        <td>L1 (in-process)</td>
+                        <td id="cache-l1-hits">-</td>
+                    </tr>
+                    <tr>
+                        <td>L2 (Redis)</td>
+                        <td id="cache-l2-hits">-</td>
+                    </tr>
+                    <tr>
+                        <td>Misses</td>
+                        <td id="cache-misses">-</td>
+                    </tr>
+                    <tr>
+                        <td>Normalized Keys</td>
+                        <td id="cache-normalized">-</td>
+                    </tr>
+                    <tr>
+                        <td>Redis Circuit Breaker</td>
+                        <td id="cache-breaker">-</td>
+                    </tr>
+                </tbody>
+            </table>
             </main>
             <footer>
                 <p>Coordenacao-geral de Informacao e Monitoramento de Obras - CGIMO<br>
@@ -441,7 +464,7 @@ async def get_stats(username: str = Depends(verify_admin)):
                             // Create a new row if it doesn't exist
                             row = tbody.insertRow(); // Insert into tbody
                             row.setAttribute('data-path', path);
-                            for (let i = 0; i < 4; i++) {
+                            for (let i = 0; i < 7; i++) {
                                 row.insertCell();
                             }
                             row.cells[0].textContent = path; // Set endpoint name
@@ -449,6 +472,9 @@ async def get_stats(username: str = Depends(verify_admin)):
                         row.cells[1].textContent = stats.count; // Update Total Requests
                         row.cells[2].textContent = stats.last_minute_count; // Update Requests/Minute
                         row.cells[3].textContent = stats.avg_time.toFixed(2); // Update Avg Response Time
+                        row.cells[4].textContent = stats.p50.toFixed(2);
+                        row.cells[5].textContent = stats.p95.toFixed(2);
+                        row.cells[6].textContent = stats.p99.toFixed(2);
                     }
 
                     // Update system stats
@@ -456,6 +482,16 @@ async def get_stats(username: str = Depends(verify_admin)):
                     document.getElementById("memory-usage").textContent = data.system.memory + "%";
                     document.getElementById("disk-usage").textContent = data.system.disk + "%";
 
+                    // Update cache stats
+                    document.getElementById("cache-l1-hits").textContent = data.cache.l1_hits;
+                    document.getElementById("cache-l2-hits").textContent = data.cache.l2_hits;
+                    document.getElementById("cache-misses").textContent = data.cache.misses;
+                    document.getElementById("cache-normalized").textContent =
+                        `${data.cache.normalized} / ${data.cache.requests}`;
+                    document.getElementById("cache-breaker").textContent =
+                        `${data.cache_server.state} (trips: ${data.cache_server.trips}, ` +
+                        `fallback calls: ${data.cache_server.fallback_calls}, error rate: ${data.cache_server.error_rate})`;
+
                     // Update the chart
                     updateMinuteChart(data);
                     updateMonthlyChart(data);
@@ -467,35 +503,54 @@ async def get_stats(username: str = Depends(verify_admin)):
     return HTMLResponse(content=html_content, status_code=status.HTTP_200_OK)
 
 
+@app.get("/metrics", include_in_schema=False, response_class=PlainTextResponse)
+async def get_metrics(username: str = Depends(verify_admin)):
+    return PlainTextResponse(await render_metrics(),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+async def build_stats_snapshot() -> dict:
+    request_stats, monthly_stats = await read_stats()
+    return {
+        "endpoints": {
+            _path.split('/')[-1]: {
+                "count": stats["count"],
+                "last_minute_count": stats["last_minute_count"],
+                "avg_time": (stats["total_time"] / stats["count"] if stats["count"] > 0 else 0) * 1000,
+                "p50": stats["p50"],
+                "p95": stats["p95"],
+                "p99": stats["p99"]
+            } for _path, stats in request_stats.items()
+        },
+        "system": {
+            "cpu": psutil.cpu_percent(),
+            "memory": psutil.virtual_memory().percent,
+            "disk": psutil.disk_usage('/').percent
+        },
+        "monthly": {
+            month: count for month, count in monthly_stats.items()
+        },
+        "cache": {**tier_stats, **key_stats},
+        "cache_server": breaker_stats()
+    }
+
+
+# Send updated stats every second, computed once per worker for all the connected dashboards
+stats_broadcaster = Broadcaster(build_stats_snapshot, interval=1, logger=logger)
+
+
 @app.websocket("/ws")
 async def stats_ws(websocket: WebSocket):
     await websocket.accept()
+    queue = stats_broadcaster.subscribe()
     try:
         while True:
-            # Send updated stats every second
-            await asyncio.sleep(1)
-            stats_data = {
-                "endpoints": {
-                    _path.split('/')[-1]: {
-                        "count": stats["count"],
-                        "last_minute_count": stats["last_minute_count"],
-                        "avg_time": (stats["total_time"] / stats["count"] if stats["count"] > 0 else 0) * 1000
-                    } for _path, stats in request_stats.items() 
-                      if not allowed_stats_paths or _path in allowed_stats_paths
-                },
-                "system": {
-                    "cpu": psutil.cpu_percent(),
-                    "memory": psutil.virtual_memory().percent,
-                    "disk": psutil.disk_usage('/').percent
-                },
-                "monthly": {
-                    month: count for month, count in monthly_stats.items()
-                }
-            }
-            await websocket.send_text(json.dumps(stats_data))
+            await websocket.send_text(await queue.get())
             
     except WebSocketDisconnect:
         pass
+    finally:
+        stats_broadcaster.unsubscribe(queue)
 
 
 # Run in terminal
@@ -0,0 +1,45 @@
+# src/broadcast.py
+import asyncio
+import orjson
+
+
+class Broadcaster:
+    """
+    Builds a snapshot once every `interval` seconds and hands the same serialized text to every subscriber.
+    The producer task only runs while there are subscribers. Each subscriber holds at most the latest
+    snapshot, so a slow client skips ticks instead of making memory grow
+    """
+    def __init__(self, build_snapshot, interval: float, logger):
+        self.build_snapshot = build_snapshot
+        self.interval = interval
+        self.logger = logger
+        self.subscribers: set[asyncio.Queue] = set()
+        self.task = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.produce())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, message: str):
+        for queue in self.subscribers:
+            if queue.full():
+                # Drops the snapshot the client did not take yet
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def produce(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.publish(orjson.dumps(await self.build_snapshot()).decode())
+            except Exception as e:
+                self.logger.warning(f"Não foi possível gerar as estatísticas: {str(e)}")
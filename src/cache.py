@@ -1,8 +1,406 @@
 # src/cache.py
-from cashews import cache
+from cashews import cache, register_backend
+from cashews.backends.memory import Memory
+from cashews.backends.redis import Redis
+from cashews.backends.redis.client_side import BcastClientSide, _empty, _empty_in_redis
+from cashews.formatter import default_formatter
+from cashews.key import default_format
+from cashews.ttl import ttl_to_seconds
+from cashews.commands import Command
+from fastapi import Request, Response
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from hashlib import blake2s
+from math import ceil
+from typing import NamedTuple, Optional
+from uuid import uuid4
+import asyncio
+import gzip
+import inspect
+import logging
+import orjson
+import time
+from src.versions import data_tag, data_version
+
+logger = logging.getLogger(__name__)
+
+# Query parameters of the list routes that make up their cache key, after the data version.
+# The request-scoped database session is left out, otherwise no two requests would ever share an entry
+PAGE_KEY_PARAMS = ("data_version", "filtros", "pagina", "tamanho_da_pagina", "cursor", "incluir_total")
+# Parameters whose values are free text, or dicts of it, which go into the key as a digest: the key
+# formatter joins names and values with ":" without escaping them, so two queries could share a key
+DIGEST_KEY_PARAMS = ("filtros", "expand")
+
+
+# The early (stale-while-revalidate) decorator stores each page under "<prefix>:v2:<key>"
+# as [soft expiration, page]
+PAGE_PREFIX = "page"
+PAGE_KEY_PREFIX = f"{PAGE_PREFIX}:v2:"
+# Longest a caller that found no cached page holds its key while reading it from the database,
+# and so the longest the other callers for that page wait for it
+FILL_LOCK_TTL = 30
+
+
+# Hits per cache tier in this worker: l1 (in-process), l2 (Redis) and misses in both
+tier_stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0}
+# Filtered requests in this worker, and how many of them had their filters rewritten to the
+# canonical form, each of which would otherwise have been a separate cache entry
+key_stats = {"requests": 0, "normalized": 0}
+# Cache locks (such as the warmup one) taken by this worker, and attempts that found them held by another
+lock_stats = {"lock_acquired": 0, "lock_contended": 0}
+
+
+class LocalTier(Memory):
+    """
+    In-process LRU bounded by size, whose entries never outlive `ttl` seconds
+    even when Redis keeps them for longer
+    """
+    def __init__(self, size: int, ttl: float):
+        super().__init__(size=size)
+        self.ttl = ttl
+
+    def _set(self, key, value, expire=None):
+        super()._set(key, value, min(expire, self.ttl) if expire else self.ttl)
+
+
+class TwoTierCache(BcastClientSide):
+    """
+    Redis backend with a LocalTier in front of it. Values read from Redis are promoted to the
+    local tier, and least recently used ones are demoted (dropped) when it is full.
+    Redis client tracking invalidates local entries when their keys change or expire on the server
+    """
+    def __init__(self, *args, local_size: int, local_ttl: str, **kwargs):
+        super().__init__(*args, local_cache=LocalTier(local_size, ttl_to_seconds(local_ttl)), **kwargs)
+
+    async def get(self, key, default=None):
+        if self._listen_started.is_set():
+            value = await self._local_cache.get(key, default=_empty)
+            if value is _empty_in_redis:
+                tier_stats["misses"] += 1
+                return default
+            if value is not _empty:
+                tier_stats["l1_hits"] += 1
+                return value
+        value = await Redis.get(self, self._add_prefix(key), default=_empty)
+        if value is _empty:
+            tier_stats["misses"] += 1
+            await self._local_cache.set(key, _empty_in_redis)
+            return default
+        tier_stats["l2_hits"] += 1
+        await self._local_cache.set(key, value)
+        return value
+
+
+class CircuitBreaker:
+    """
+    Cashews middleware that sends the commands to an in-process fallback while the cache server
+    is failing or slow, instead of failing or delaying every request.
+    Closed: commands go to the server, and errors, timeouts and slow calls are counted over the last `window` calls.
+    Open: commands go to the fallback until `cooldown` seconds have passed.
+    Half-open: a single probe goes to the server; it closes the breaker if it succeeds, otherwise it opens again.
+    A probe that is cancelled opens it again too, and one that outlives `timeout` gives way to a new probe
+    """
+    def __init__(self, fallback_size: int, window: int, min_calls: int, error_rate: float,
+                 slow_call: float, timeout: float, cooldown: float):
+        self.fallback = Memory(size=fallback_size)
+        self.outcomes = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.timeout = timeout
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.trips = 0
+        self.fallback_calls = 0
+
+    def stats(self) -> dict:
+        failures = self.outcomes.count(False)
+        return {"state": self.state, "trips": self.trips, "fallback_calls": self.fallback_calls,
+                "error_rate": round(failures / len(self.outcomes), 2) if self.outcomes else 0.0}
+
+    def open(self):
+        if self.state != "open":
+            logger.warning("Servidor de cache indisponível; usando o cache local")
+            self.trips += 1
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+    def record(self, success: bool, probe: bool):
+        if probe:
+            if not success:
+                self.open()
+                return
+            logger.info("Servidor de cache restabelecido")
+            self.state = "closed"
+            self.outcomes.clear()
+            self.fallback.store.clear()
+            return
+        if self.state != "closed":
+            # A call that started before the breaker opened
+            return
+        self.outcomes.append(success)
+        if len(self.outcomes) >= self.min_calls and self.outcomes.count(False) / len(self.outcomes) >= self.error_rate:
+            self.open()
+
+    async def to_fallback(self, cmd: Command, *args, **kwargs):
+        self.fallback_calls += 1
+        result = getattr(self.fallback, cmd.value)(*args, **kwargs)
+        # scan and get_match return async iterators, like the server backend does
+        return await result if inspect.isawaitable(result) else result
+
+    async def __call__(self, call, cmd: Command, backend, *args, **kwargs):
+        started = time.monotonic()
+        probe = False
+        if self.state == "open":
+            if started - self.opened_at < self.cooldown:
+                return await self.to_fallback(cmd, *args, **kwargs)
+            probe = True
+        elif self.state == "half_open":
+            # A probe is already in flight, until its deadline
+            if started - self.probe_started < self.timeout:
+                return await self.to_fallback(cmd, *args, **kwargs)
+            probe = True
+        if probe:
+            self.state = "half_open"
+            self.probe_started = started
+
+        recorded = False
+        try:
+            try:
+                result = await asyncio.wait_for(call(*args, **kwargs), self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Falha no servidor de cache em {cmd.value}: {e.__repr__()}")
+                recorded = True
+                self.record(False, probe)
+                return await self.to_fallback(cmd, *args, **kwargs)
+            recorded = True
+            self.record(time.monotonic() - started < self.slow_call, probe)
+            return result
+        finally:
+            # A cancelled probe must not leave the breaker half-open, unless a newer probe took over
+            if probe and not recorded and self.state == "half_open" and self.probe_started == started:
+                self.open()
+
+
+async def count_locks(call, cmd: Command, backend, *args, **kwargs):
+    result = await call(*args, **kwargs)
+    if cmd == Command.SET_LOCK:
+        lock_stats["lock_acquired" if result else "lock_contended"] += 1
+    return result
+
+
+# Breaker of the cache server, when it is Redis
+breaker = None
+
+
+def breaker_stats() -> dict:
+    if breaker is None:
+        return {"state": "disabled", "trips": 0, "fallback_calls": 0, "error_rate": 0.0}
+    return breaker.stats()
+
+
+def _redis_backend(local_size: int = 0, local_ttl: str = "1m", client_side: bool = False, **params):
+    if local_size:
+        return TwoTierCache(local_size=local_size, local_ttl=local_ttl, **params)
+    return BcastClientSide(**params) if client_side else Redis(**params)
+
+
+register_backend("redis", _redis_backend, pass_uri=True)
+register_backend("rediss", _redis_backend, pass_uri=True)
+
+
+# Client of the cache server, shared by the stores kept in Redis by other modules (stats, warmup)
+redis_client = None
+
+
+def shared_store(settings, local_store, redis_store):
+    """
+    Store shared by every worker through the cache server when it is Redis, built on the one client;
+    otherwise (development) a store local to the worker
+    """
+    global redis_client
+    if not settings.CACHE_SERVER_URL.startswith("redis"):
+        return local_store()
+    if redis_client is None:
+        import redis.asyncio as redis
+        redis_client = redis.from_url(settings.CACHE_SERVER_URL, decode_responses=True)
+    return redis_store(redis_client)
+
 
 def setup_cache(settings):
-    # Setup cache server
+    # Setup cache server, with the in-process tier in front of Redis
+    global breaker
+    options = {}
+    if settings.CACHE_SERVER_URL.startswith("redis"):
+        options = {"local_size": settings.CACHE_LOCAL_SIZE, "local_ttl": settings.CACHE_LOCAL_TTL}
+        breaker = CircuitBreaker(fallback_size=settings.CACHE_LOCAL_SIZE,
+                                 window=settings.CACHE_BREAKER_WINDOW,
+                                 min_calls=settings.CACHE_BREAKER_MIN_CALLS,
+                                 error_rate=settings.CACHE_BREAKER_ERROR_RATE,
+                                 slow_call=settings.CACHE_BREAKER_SLOW_CALL,
+                                 timeout=settings.CACHE_BREAKER_TIMEOUT,
+                                 cooldown=settings.CACHE_BREAKER_COOLDOWN)
+        # Added as a default middleware so it is the outermost one, covering the connection on first use too
+        cache.add_middleware(breaker)
     cache.setup(settings.CACHE_SERVER_URL, 
+                middlewares=(count_locks,),
                 enable=True,
-                suppress=False)
+                suppress=False,
+                **options)
+
+
+class EncodedResponse(NamedTuple):
+    """
+    Response body as sent to the client, so a cache hit skips validation and serialization
+    """
+    body: bytes
+    gzip_body: Optional[bytes]
+    etag: str
+
+
+def encode_response(api_route, page, gzip_min_size: int) -> EncodedResponse:
+    """
+    Validates and serializes the page against the route's response model, exactly as FastAPI would
+    """
+    exclude_unset = api_route.response_model_exclude_unset
+    content = api_route.response_model.model_validate(page.model_dump(exclude_unset=exclude_unset))
+    body = orjson.dumps(content.model_dump(mode="json", exclude_unset=exclude_unset))
+    gzip_body = gzip.compress(body, compresslevel=6) if len(body) >= gzip_min_size else None
+    return EncodedResponse(body, gzip_body, f'"{blake2s(body).hexdigest()}"')
+
+
+def send_response(request: Request, encoded: EncodedResponse) -> Response:
+    headers = {"ETag": encoded.etag, "Vary": "Accept-Encoding"}
+    if encoded.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if encoded.gzip_body is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(encoded.gzip_body, media_type="application/json", headers=headers)
+    return Response(encoded.body, media_type="application/json", headers=headers)
+
+
+@default_formatter.register("digest", preformat=False)
+def key_digest(value) -> str:
+    return blake2s(orjson.dumps(value, option=orjson.OPT_SORT_KEYS, default=str), digest_size=16).hexdigest()
+
+
+def page_key(route: str, extra_params: tuple = ()) -> str:
+    return ":".join([route, *(f"{name}:{{{name}:digest}}" if name in DIGEST_KEY_PARAMS else f"{name}:{{{name}}}"
+                              for name in (*PAGE_KEY_PARAMS, *extra_params))])
+
+
+async def seed_id_lookups(key: str, ttl: str, soft_ttl: str, tags: list[str], call_values: dict, result, encode):
+    """
+    Stores, for a complete first page fetched with a list of ids, the page that each of those ids
+    would return alone, so later single-id requests are answered from the cache.
+    The entries get the tags of the page, so a load of the tables drops them too
+    """
+    filtros = call_values["filtros"]
+    id_filters = [name for name, value in filtros.items() if isinstance(value, list) and len(value) > 1]
+    if len(id_filters) != 1 or call_values["pagina"] != 1 or call_values["cursor"] or result.next_cursor:
+        return
+    name = id_filters[0]
+    pages = {value: [] for value in filtros[name]}
+    for item in result.data:
+        pages.get(item[name], []).append(item)
+
+    include_total = call_values["incluir_total"]
+    soft_expire_at = datetime.now(timezone.utc) + timedelta(seconds=ttl_to_seconds(soft_ttl))
+    entries = {}
+    for value, items in pages.items():
+        entry_key = PAGE_KEY_PREFIX + default_format(key, **{**call_values, "filtros": {**filtros, name: [value]}})
+        entries[entry_key] = [soft_expire_at, encode(result.model_copy(update={
+            "data": items,
+            "total_pages": ceil(len(items) / call_values["tamanho_da_pagina"]) if include_total else None,
+            "total_items": len(items) if include_total else None,
+            "total_items_exact": True if include_total else None,
+            "page_size": len(items),
+        }))]
+    await cache.set_many(entries, expire=ttl)
+    # set_many doesn't take tags: the keys are added to the tag sets the way cache.set does it
+    for tag in tags:
+        await cache.set_add(cache._tags_key_prefix + tag, *entries, expire=ttl_to_seconds(ttl))
+
+
+def page_cache(ttl: str, soft_ttl: str, route: str, extra_params: tuple = (), tables: tuple = (),
+               gzip_min_size: int = 1024):
+    """
+    Caches the paginated list routes under a key made of the data version of the tables they read
+    (the route's own by default) and their query parameters, tagged with those tables.
+    What is cached is the encoded body (and its gzip version, from gzip_min_size bytes) with its ETag,
+    which is sent as is on a hit.
+    Past soft_ttl the cached page is still served while a single background task refreshes it;
+    only past ttl does a caller wait for the database, and then a single one reads the page.
+    Pages fetched with a list of ids also populate the entries of each single id.
+    The database session is opened only when the page is read, instead of by the route's dependency
+    """
+    key = page_key(route, extra_params)
+    tables = tables or (route,)
+    tags = [data_tag(table) for table in tables]
+
+    def decorator(func):
+        # FastAPI route of the decorated function, taken from the first request
+        api_routes = []
+
+        def encode(page) -> EncodedResponse:
+            return encode_response(api_routes[0], page, gzip_min_size)
+
+        async def fetching(data_version: str, **kwargs) -> EncodedResponse:
+            from main import db
+            # The session is opened here rather than per request: a hit needs none, and a refresh runs
+            # after the response is sent, when a request-scoped session would already be closed
+            async with db.read_session_maker()() as session:
+                result = await func(**{**kwargs, "dbsession": session})
+            await seed_id_lookups(key, ttl, soft_ttl, tags, {**kwargs, "data_version": data_version}, result, encode)
+            return encode(result)
+
+        async def seeding(data_version: str, **kwargs):
+            # early only guards the background refresh. When the page is missing (cold or past ttl),
+            # a lock lets a single caller, on any worker, read it while the others wait for the stored page
+            entry_key = PAGE_KEY_PREFIX + default_format(key, **{**kwargs, "data_version": data_version})
+            lock_key = f"{entry_key}:fill"
+            identifier = str(uuid4())
+            if await cache.set_lock(lock_key, identifier, expire=FILL_LOCK_TTL):
+                try:
+                    encoded = await fetching(data_version, **kwargs)
+                    # Stored before the lock is released, for the callers waiting on it
+                    soft_expire_at = datetime.now(timezone.utc) + timedelta(seconds=ttl_to_seconds(soft_ttl))
+                    await cache.set(entry_key, [soft_expire_at, encoded], expire=ttl, tags=tags)
+                    return encoded
+                finally:
+                    await cache.unlock(lock_key, identifier)
+            await cache.is_locked(lock_key, wait=FILL_LOCK_TTL)
+            cached_entry = await cache.get(entry_key)
+            if cached_entry is not None:
+                return cached_entry[1]
+            # The caller holding the lock failed or is taking too long
+            return await fetching(data_version, **kwargs)
+
+        # The version is passed as one more keyword argument, so it is part of the key template
+        signature = inspect.signature(func)
+        seeding.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter("data_version", inspect.Parameter.KEYWORD_ONLY, annotation=str)
+        ])
+        cached = cache.early(ttl=ttl, early_ttl=soft_ttl, key=key, prefix=PAGE_PREFIX, tags=tags)(seeding)
+
+        @wraps(func)
+        async def wrapper(request: Request, **kwargs):
+            if not api_routes:
+                api_routes.append(request.scope["route"])
+            encoded = await cached(data_version=data_version(*tables), **kwargs)
+            return send_response(request, encoded)
+
+        # The request is needed for the conditional and compressed responses, but is not part of the key.
+        # The dbsession dependency of the route is dropped, as the session comes from fetching
+        wrapper.__signature__ = signature.replace(parameters=[
+            *(parameter for name, parameter in signature.parameters.items() if name != "dbsession"),
+            inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+        ])
+        return wrapper
+    return decorator
@@ -0,0 +1,126 @@
+# src/counts.py
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement, True_
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlmodel import select, func
+from typing import Optional
+from hashlib import sha1
+import orjson
+from src.cache import cache
+from src.filters import template_cache
+from src.versions import data_tag, data_version
+from appconfig import Settings
+
+config = Settings()
+
+
+@template_cache(variants=1)
+def count_statement(query: select) -> select:
+    return select(func.count()).select_from(query.subquery())
+
+
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN (FORMAT JSON) of a statement, executed with bound parameters so each query template
+    is prepared once, whatever the filter values
+    """
+    inherit_cache = True
+    _traverse_internals = [("statement", InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+@template_cache(variants=1)
+def explain_statement(query: select) -> Explain:
+    return Explain(query)
+
+
+def count_cache_key(query: select, params: dict) -> str:
+    """
+    Builds a cache key from the table and the bound values of the query. The queries come from a FilterSet,
+    where the parameter names identify the filters applied, so equivalent filters share the count
+    """
+    table = inspect(query.column_descriptions[0]["entity"]).local_table.name
+    signature = orjson.dumps(params, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+    return f"count:{table}:{data_version(table)}:{sha1(signature).hexdigest()}"
+
+
+async def estimate_table_rows(query: select, dbsession: AsyncSession) -> int:
+    """
+    Reads the planner's row estimate for the whole table from pg_class
+    """
+    table = inspect(query.column_descriptions[0]["entity"]).local_table
+    return await dbsession.scalar(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:name AS regclass)"),
+        {"name": f"{table.schema}.{table.name}"}
+    )
+
+
+async def estimate_query_rows(query: select, params: dict, dbsession: AsyncSession) -> int:
+    """
+    Reads the planner's row estimate for the filtered query from EXPLAIN
+    """
+    plan = await dbsession.scalar(explain_statement(query), params)
+    if isinstance(plan, str):
+        plan = orjson.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def cached_count(query: select, params: dict) -> tuple[str, Optional[int]]:
+    """
+    Returns the cache key of the exact count of the query, and the count when it is cached
+    """
+    key = count_cache_key(query, params)
+    return key, await cache.get(key)
+
+
+async def estimate_count(query: select, params: dict, dbsession: AsyncSession) -> Optional[int]:
+    try:
+        if query.whereclause is None or isinstance(query.whereclause, True_):
+            return await estimate_table_rows(query, dbsession)
+        return await estimate_query_rows(query, params, dbsession)
+    except Exception:
+        return None
+
+
+async def store_count(query: select, key: str, total_records: int):
+    table = inspect(query.column_descriptions[0]["entity"]).local_table.name
+    await cache.set(key, total_records, expire=config.COUNT_CACHE_TTL, tags=[data_tag(table)])
+
+
+async def exact_count(query: select, params: dict, dbsession: AsyncSession, key: str) -> int:
+    total_records = await dbsession.scalar(count_statement(query), params)
+    await store_count(query, key, total_records)
+    return total_records
+
+
+async def exact_count_in_new_session(query: select, params: dict, dbsession: AsyncSession, key: str) -> int:
+    """
+    Counts on a connection of its own, so it runs at the same time as the page query.
+    The connection comes from the engine of `dbsession`, so the count and the page read the same server
+    """
+    async with AsyncSession(dbsession.bind) as session:
+        return await exact_count(query, params, session, key)
+
+
+def count_strategy(estimate: Optional[int], keyset: bool) -> str:
+    """
+    Picks how to get an exact count along with the page. A window count over a small result set
+    costs a single round-trip; larger ones are counted on a second connection, concurrently with the page.
+    The window counts the rows after the cursor on keyset pages, so it is only used with offsets
+    """
+    strategy = config.COUNT_STRATEGY
+    if strategy == "auto":
+        strategy = "window" if estimate is not None and estimate <= config.WINDOW_COUNT_MAX_ROWS else "concurrent"
+    if strategy == "window" and keyset:
+        strategy = "concurrent"
+    return strategy
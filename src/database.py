@@ -1,32 +1,158 @@
 import asyncio
-from typing import AsyncGenerator
+import random
+from typing import AsyncGenerator, Optional
+from uuid import uuid4
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import event, text
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.util import LRUCache
 from sqlmodel import SQLModel, Session
 from sqlmodel.ext.asyncio.session import AsyncSession
 from appconfig import Settings
+from src import versions
+from src.filters import filter_sets
+from src.models import lower_indexes, range_indexes, search_indexes
 import logging
+import time
 from tenacity import retry, stop_after_attempt, wait_fixed
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Connections handed out by each engine pool of this worker, and the time spent waiting for them, by engine name
+pool_stats = {}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Engine pool that measures how long each checkout waits for a free connection, in the pool_stats of its engine
+    """
+    engine_name = "primary"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = pool_stats.setdefault(self.engine_name, {"pool_waits": 0, "pool_wait_us": 0})
+            stats["pool_waits"] += 1
+            stats["pool_wait_us"] += int((time.perf_counter() - started) * 1_000_000)
+
+
+# Statement lookups in the prepared statement caches of this worker, and how many of them had to prepare
+statement_stats = {"statement_executions": 0, "statement_prepares": 0}
+# Statements run for each filter template: page by offset, page by cursor, page with a window count, count and EXPLAIN
+STATEMENTS_PER_TEMPLATE = 5
+# Initial size of the prepared statement caches, and room for the statements that don't come from a filter template
+STATEMENT_CACHE_START = 100
+# Distinct statements prepared by the connections of this worker
+observed_statements = set()
+
+
+class StatementCache(LRUCache):
+    """
+    Per-connection LRU of the asyncpg prepared statements, counting lookups and prepares.
+    Every connection runs the same statements, so with a `max_size` its capacity grows, up to it,
+    with the distinct statements observed on all the connections of the worker
+    """
+    def __init__(self, capacity: int, max_size: Optional[int] = None):
+        super().__init__(capacity)
+        self.max_size = max_size
+
+    def __contains__(self, operation) -> bool:
+        statement_stats["statement_executions"] += 1
+        return super().__contains__(operation)
+
+    def __setitem__(self, operation, statement):
+        statement_stats["statement_prepares"] += 1
+        if self.max_size is not None:
+            if len(observed_statements) < self.max_size:
+                observed_statements.add(operation)
+            self.capacity = max(self.capacity, len(observed_statements))
+        super().__setitem__(operation, statement)
+
+
+def create_engine(url: str, name: str = "primary"):
+    settings = Settings()
+    cache_size, max_size = settings.DB_STATEMENT_CACHE_SIZE, None
+    if cache_size is None:
+        # Sized from the statements actually run, bounded by what the filter templates of all the routes
+        # can produce, since the FilterSets share the connections
+        cache_size = STATEMENT_CACHE_START
+        max_size = (len(filter_sets) * STATEMENTS_PER_TEMPLATE * settings.FILTER_TEMPLATE_CACHE_SIZE
+                    + STATEMENT_CACHE_START)
+    connect_args = {"prepared_statement_cache_size": cache_size}
+    if settings.DB_PGBOUNCER:
+        # Server connections are shared, so the sequential names of asyncpg would collide
+        connect_args.update({"prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+                             "statement_cache_size": 0})
+    engine = create_async_engine(
+        url,  # MUST be postgresql+asyncpg://...
+        future=True,
+        pool_pre_ping=True,
+        # A subclass per engine, since the pool is recreated from its class on dispose
+        poolclass=type(TimedQueuePool.__name__, (TimedQueuePool,), {"engine_name": name}),
+        pool_size=10,
+        max_overflow=20,
+        pool_recycle=3600,  # recycle the connections after 1 hour (3600 seconds)
+        connect_args=connect_args
+    )
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def count_statements(dbapi_connection, _):
+        if cache_size:
+            dbapi_connection._prepared_statement_cache = StatementCache(cache_size, max_size)
+
+    return engine
+
+
+class Replica:
+    """
+    Read replica, healthy while it answers and its replication lag stays within REPLICA_MAX_LAG.
+    `latency` is a moving average of its health check round trip, used to weight the choice among replicas,
+    and `replay_lsn` the WAL position it had replayed at the check
+    """
+    def __init__(self, url: str, name: str):
+        self.name = name
+        self.engine = create_engine(url, name)
+        self.async_session_maker = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.healthy = False
+        self.latency = None
+        self.replay_lsn = None
+
+    async def check(self, max_lag: int):
+        started = time.perf_counter()
+        async with self.engine.connect() as conn:
+            # Without writes on the primary the last replayed transaction gets older and older,
+            # so a replica that replayed all the WAL it received has no lag
+            result = await conn.execute(text(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, "
+                "(pg_last_wal_replay_lsn() - '0/0'::pg_lsn)::bigint"
+            ))
+            lag, self.replay_lsn = result.one()
+        elapsed = time.perf_counter() - started
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        # No replay timestamp: nothing was replayed yet, or the server is not in recovery
+        self.healthy = lag is None or lag <= max_lag
+
+    def replayed(self, lsn: int) -> bool:
+        # A server that is not in recovery has no replay position
+        return self.replay_lsn is None or self.replay_lsn >= lsn
+
+
 # Initialize engine and sessionmaker once (no globals)
 class Database:
     def __init__(self):
         self.engine = None
         self.async_session_maker = None
+        self.replicas = []
 
     @retry(stop=stop_after_attempt(5), wait=wait_fixed(3))
     async def init_db(self):
         settings = Settings()
-        self.engine = create_async_engine(
-            settings.DATABASE_URL,  # MUST be postgresql+asyncpg://...
-            future=True,
-            pool_pre_ping=True,
-            pool_size=10,
-            max_overflow=20,
-            pool_recycle=3600  # recycle the connections after 1 hour (3600 seconds)
-        )
+        self.engine = create_engine(settings.DATABASE_URL)
         
         # Test connection
         async with self.engine.begin() as conn:
@@ -35,13 +161,78 @@ class Database:
         # Create tables
         async with self.engine.begin() as conn:
             await conn.run_sync(SQLModel.metadata.create_all)
+
+        if settings.CREATE_SEARCH_INDEXES:
+            await self.create_indexes()
         
         self.async_session_maker = async_sessionmaker(
             bind=self.engine, 
             expire_on_commit=False
         )
 
+        self.replicas = [Replica(url, f"replica{i}") for i, url in enumerate(settings.DATABASE_REPLICA_URLS, 1)]
+        await self.check_replicas(settings.REPLICA_MAX_LAG)
+
+    async def create_indexes(self):
+        # create_all skips indexes of tables that already exist, so they are checked one by one.
+        # CONCURRENTLY avoids blocking the ETL writes and needs a connection outside a transaction
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            indexes = [*range_indexes, *lower_indexes.values()]
+            # Trigram matching, needed by the search indexes
+            try:
+                await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                indexes.extend(search_indexes.values())
+            except Exception as e:
+                logger.warning(f"Não foi possível habilitar a extensão pg_trgm: {str(e)}")
+            for index in indexes:
+                index.dialect_options["postgresql"]["concurrently"] = True
+                try:
+                    await conn.execute(CreateIndex(index, if_not_exists=True))
+                except Exception as e:
+                    logger.warning(f"Não foi possível criar o índice {index.name}: {str(e)}")
+                finally:
+                    index.dialect_options["postgresql"]["concurrently"] = False
+            # An interrupted concurrent build leaves an invalid index behind, which IF NOT EXISTS won't rebuild
+            result = await conn.execute(
+                text("SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                     "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"),
+                {"names": [index.name for index in indexes]}
+            )
+            for name in result.scalars():
+                logger.warning(f"Índice {name} inválido; remova-o para que seja recriado na próxima inicialização")
+
     async def get_db_session(self) -> AsyncGenerator[AsyncSession, None]:
         async with self.async_session_maker() as session:
             yield session
 
+    async def check_replicas(self, max_lag: int):
+        for replica in self.replicas:
+            try:
+                await replica.check(max_lag)
+            except Exception as e:
+                # Logged once per outage, and on the first check
+                if replica.healthy or replica.latency is None:
+                    logger.warning(f"Réplica {replica.engine.url.host} indisponível: {str(e)}")
+                replica.healthy = False
+
+    async def watch_replicas(self, interval: int, max_lag: int):
+        while True:
+            await asyncio.sleep(interval)
+            await self.check_replicas(max_lag)
+
+    def read_session_maker(self) -> async_sessionmaker:
+        """
+        Session maker for read-only work: a healthy replica that replayed the current data versions, chosen
+        with a weight inverse to its latency, or the primary when there is none
+        """
+        healthy = [replica for replica in self.replicas if replica.healthy and replica.replayed(versions.data_lsn)]
+        if not healthy:
+            return self.async_session_maker
+        replica = random.choices(healthy, weights=[1 / max(replica.latency, 1e-4) for replica in healthy])[0]
+        return replica.async_session_maker
+
+    async def get_read_session(self) -> AsyncGenerator[AsyncSession, None]:
+        async with self.read_session_maker()() as session:
+            yield session
+
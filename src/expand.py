@@ -0,0 +1,121 @@
+# src/expand.py
+from fastapi import HTTPException, Query, status
+from sqlalchemy import any_, bindparam, inspect, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+from typing import Optional
+from src import models
+from appconfig import Settings
+
+config = Settings()
+
+
+class Relation:
+    """
+    Children of a model, reached through the foreign key column `foreign_key` of the child table.
+    All children of a page are read with a single = ANY(array) query on that column, whose SQL text
+    doesn't depend on the number of parents
+    """
+    def __init__(self, model, foreign_key: str):
+        self.model = model
+        table = inspect(model).local_table
+        self.foreign_key = table.c[foreign_key]
+        # Parent column referenced by the foreign key
+        self.parent_key = next(iter(self.foreign_key.foreign_keys)).column.key
+        self.statement = (
+            select(*table.columns)
+            .where(self.foreign_key == any_(bindparam("parent_keys", type_=ARRAY(self.foreign_key.type))))
+            .order_by(*inspect(model).primary_key)
+            .limit(bindparam("children_limit", type_=Integer))
+        )
+
+
+RELATIONS = {
+    models.Programa: {
+        "planos_acao": Relation(models.PlanoAcao, "id_programa"),
+    },
+    models.PlanoAcao: {
+        "metas": Relation(models.PlanoAcaoMeta, "id_plano_acao"),
+        "notas_credito": Relation(models.NotaCredito, "id_plano_acao"),
+    },
+    models.PlanoAcaoMeta: {
+        "etapas": Relation(models.PlanoAcaoEtapa, "id_meta"),
+    },
+    models.NotaCredito: {
+        "eventos": Relation(models.Evento, "id_nota"),
+    },
+}
+
+
+def expand_tables(model) -> tuple:
+    """
+    Tables that a route of the model may read through expand, whose data versions its cache depends on
+    """
+    tables = [inspect(model).local_table.name]
+    for relation in RELATIONS.get(model, {}).values():
+        tables.extend(expand_tables(relation.model))
+    return tuple(tables)
+
+
+def expand_paths(model, prefix: str = "") -> list[str]:
+    paths = []
+    for name, relation in RELATIONS.get(model, {}).items():
+        paths.append(prefix + name)
+        paths.extend(expand_paths(relation.model, f"{prefix}{name}."))
+    return paths
+
+
+def parse_expand(model, expand: Optional[str]) -> dict:
+    """
+    Turns "metas.etapas,notas_credito" into the tree {"metas": {"etapas": {}}, "notas_credito": {}},
+    rejecting names that are not relations of the model
+    """
+    tree = {}
+    for path in filter(None, (path.strip() for path in (expand or "").split(","))):
+        node, current = tree, model
+        for name in path.split("."):
+            relation = RELATIONS.get(current, {}).get(name)
+            if relation is None:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"{config.ERROR_MESSAGE_INVALID_EXPAND} {name}")
+            node, current = node.setdefault(name, {}), relation.model
+    return tree
+
+
+def expand_dependency(model):
+    """
+    Builds the FastAPI dependency for the `expand` query parameter of the model, listing the available paths
+    """
+    async def dependency(
+        expand: Optional[str] = Query(None, description="Relacionamentos a Incluir, separados por vírgula: "
+                                                        + ", ".join(expand_paths(model)))
+    ) -> dict:
+        return parse_expand(model, expand)
+    return dependency
+
+
+async def load_expansions(dbsession: AsyncSession, model, items: list[dict], tree: dict):
+    """
+    Attaches to each item the children requested in the tree, issuing one query per relation and level.
+    A level with more than MAX_EXPAND_CHILDREN children is rejected rather than truncated
+    """
+    for name, subtree in tree.items():
+        relation = RELATIONS[model][name]
+        parent_keys = {item[relation.parent_key] for item in items if item[relation.parent_key] is not None}
+        children = []
+        if parent_keys:
+            result = await dbsession.execute(relation.statement, {"parent_keys": list(parent_keys),
+                                                                  "children_limit": config.MAX_EXPAND_CHILDREN + 1})
+            children = [dict(row) for row in result.mappings()]
+            if len(children) > config.MAX_EXPAND_CHILDREN:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"{config.ERROR_MESSAGE_EXPAND_TOO_LARGE} {name}")
+        if subtree:
+            await load_expansions(dbsession, relation.model, children, subtree)
+
+        grouped = {}
+        for child in children:
+            grouped.setdefault(child[relation.foreign_key.key], []).append(child)
+        for item in items:
+            item[name] = grouped.get(item[relation.parent_key], [])
@@ -0,0 +1,137 @@
+# src/export.py
+from fastapi.responses import StreamingResponse
+from sqlalchemy import inspect
+from sqlmodel import select
+from typing import AsyncIterator
+from enum import Enum
+import orjson
+import csv
+import io
+from appconfig import Settings
+
+config = Settings()
+
+
+class FormatoExportacao(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+    arrow = "arrow"
+    parquet = "parquet"
+
+
+MEDIA_TYPES = {
+    FormatoExportacao.ndjson: "application/x-ndjson",
+    FormatoExportacao.csv: "text/csv; charset=utf-8",
+    FormatoExportacao.arrow: "application/vnd.apache.arrow.stream",
+    FormatoExportacao.parquet: "application/vnd.apache.parquet",
+}
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Write-only file object that hands out what was written so far, keeping the absolute
+    position that the Arrow and Parquet writers record in their metadata
+    """
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def stream_rows(query: select, params: dict) -> AsyncIterator[list]:
+    """
+    Reads the query through a server-side cursor, yielding batches of row mappings.
+    The session is opened here because the request-scoped one is closed before a streamed body is sent
+    """
+    from main import db
+    mapper = inspect(query.column_descriptions[0]["entity"])
+    rows_query = query.with_only_columns(*mapper.local_table.columns)
+    async with db.read_session_maker()() as session:
+        result = await session.stream(rows_query.execution_options(yield_per=config.EXPORT_BATCH_SIZE), params)
+        async for partition in result.mappings().partitions():
+            yield partition
+
+
+async def ndjson_chunks(query: select, params: dict) -> AsyncIterator[bytes]:
+    async for rows in stream_rows(query, params):
+        yield b"".join(orjson.dumps(dict(row)) + b"\n" for row in rows)
+
+
+async def csv_chunks(query: select, params: dict) -> AsyncIterator[bytes]:
+    mapper = inspect(query.column_descriptions[0]["entity"])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([col.key for col in mapper.local_table.columns])
+    async for rows in stream_rows(query, params):
+        writer.writerows(row.values() for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, when the query returns no rows
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def arrow_schema(query: select):
+    import pyarrow as pa
+    from sqlalchemy import Boolean, Date, DateTime, Float, Integer
+    arrow_types = ((Boolean, pa.bool_()), (DateTime, pa.timestamp("us")), (Date, pa.date32()),
+                   (Integer, pa.int64()), (Float, pa.float64()))
+    fields = []
+    for col in inspect(query.column_descriptions[0]["entity"]).local_table.columns:
+        arrow_type = next((_type for sa_type, _type in arrow_types if isinstance(col.type, sa_type)), pa.string())
+        fields.append(pa.field(col.key, arrow_type, nullable=col.nullable))
+    return pa.schema(fields)
+
+
+async def columnar_chunks(query: select, params: dict, export_format: FormatoExportacao) -> AsyncIterator[bytes]:
+    """
+    Builds one Arrow record batch per streamed partition and writes it as an IPC stream
+    or as a Parquet row group, flushing the encoded bytes after every batch
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = arrow_schema(query)
+    sink = ChunkSink()
+    if export_format == FormatoExportacao.parquet:
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    async for rows in stream_rows(query, params):
+        writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_data(query: select, params: dict, export_format: FormatoExportacao, file_name: str) -> StreamingResponse:
+    """
+    Streams every row matched by the query as NDJSON, CSV, Arrow IPC or Parquet, with memory bounded by EXPORT_BATCH_SIZE
+    """
+    if export_format in (FormatoExportacao.arrow, FormatoExportacao.parquet):
+        chunks = columnar_chunks(query, params, export_format)
+    elif export_format == FormatoExportacao.csv:
+        chunks = csv_chunks(query, params)
+    else:
+        chunks = ndjson_chunks(query, params)
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{file_name}.{export_format.value}"'}
+    )
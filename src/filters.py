@@ -0,0 +1,234 @@
+# src/filters.py
+from fastapi import HTTPException, Query, status
+from sqlalchemy import any_, bindparam, func, inspect as sa_inspect
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlmodel import select, and_
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache, wraps
+from typing import List, Optional
+import inspect
+from src.cache import key_stats
+from src.models import lower_index, trgm_index
+from appconfig import Settings
+
+config = Settings()
+
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+# Columns that also get _de/_ate range filters
+RANGE_PREFIXES = ("dt_", "dh_", "vl_")
+# Every FilterSet of the routes, as they are built
+filter_sets = []
+
+
+class Filter:
+    """
+    Query parameter mapped to a model column.
+    operator: "eq" (equality), "ilike" (case-insensitive substring), "iexact" (case-insensitive equality),
+    "gte" or "lte" (inclusive bounds of a range filter on `column`, which defaults to the parameter name).
+    Date and datetime columns are compared by date, from a YYYY-MM-DD parameter, always as half-open ranges
+    on the raw column so its B-tree index can be used.
+    Integer id_ columns accept a list of values (repeated or comma-separated), matched with = ANY(array)
+    """
+    def __init__(self, name: str, description: str, operator: str = "eq", column: Optional[str] = None,
+                 **query_kwargs):
+        self.name = name
+        self.description = description
+        self.operator = operator
+        self.column_name = column or name
+        self.query_kwargs = query_kwargs
+        self.column = None
+        self.python_type = None
+
+    def ranges(self) -> tuple:
+        """
+        The _de and _ate filters of a dt_, dh_ or vl_ column
+        """
+        if self.operator != "eq" or not self.name.startswith(RANGE_PREFIXES):
+            return ()
+        return (Filter(f"{self.name}_de", f"{self.description} - a partir de (inclusive)", "gte", column=self.name),
+                Filter(f"{self.name}_ate", f"{self.description} - até (inclusive)", "lte", column=self.name))
+
+    def bind(self, model):
+        self.column = sa_inspect(model).local_table.c[self.column_name]
+        try:
+            self.python_type = self.column.type.python_type
+        except NotImplementedError:
+            # sqlmodel's AutoString doesn't report its python type
+            self.python_type = str
+        if self.python_type in (date, datetime):
+            if self.operator == "eq":
+                self.operator = "date"
+            self.query_kwargs.setdefault("pattern", DATE_PATTERN)
+        elif self.operator == "eq" and self.name.startswith("id_") and self.python_type is int:
+            self.operator = "any"
+        elif self.operator == "ilike":
+            trgm_index(self.column)
+        elif self.operator == "iexact":
+            lower_index(self.column)
+        return self
+
+    @property
+    def annotation(self):
+        if self.python_type in (date, datetime):
+            return Optional[str]
+        if self.operator == "any":
+            return Optional[List[str]]
+        return Optional[self.python_type]
+
+    def clause(self):
+        if self.operator == "ilike":
+            return self.column.ilike(bindparam(self.name))
+        if self.operator == "iexact":
+            # The value is already lower-cased (see canonical)
+            return func.lower(self.column) == bindparam(self.name)
+        if self.operator == "date" and self.python_type is datetime:
+            return and_(self.column >= bindparam(self.name), self.column < bindparam(f"{self.name}__fim"))
+        if self.operator == "any":
+            # A single array parameter keeps one statement whatever the number of ids
+            return self.column == any_(bindparam(self.name, type_=ARRAY(self.column.type)))
+        if self.operator == "gte":
+            return self.column >= bindparam(self.name)
+        if self.operator == "lte":
+            # The upper bound of a date range is the start of the next day
+            if self.python_type in (date, datetime):
+                return self.column < bindparam(self.name)
+            return self.column <= bindparam(self.name)
+        return self.column == bindparam(self.name)
+
+    def parse(self, value):
+        """
+        Splits and converts the values of a list filter, rejecting anything that is not an id,
+        and rejects dates that don't exist
+        """
+        if value is None:
+            return value
+        if self.python_type in (date, datetime):
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"{config.ERROR_MESSAGE_INVALID_DATE} {self.name}")
+            return value
+        if self.operator != "any":
+            return value
+        try:
+            ids = [int(item) for values in value for item in values.split(",") if item.strip()]
+        except ValueError:
+            ids = None
+        if ids is None or len(ids) > config.MAX_FILTER_IDS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"{config.ERROR_MESSAGE_INVALID_ID_LIST} {self.name}")
+        return ids or None
+
+    def canonical(self, value):
+        """
+        Canonical form of the value, so equivalent requests share a cache entry and a statement:
+        ILIKE is case-insensitive and the order of ids doesn't matter for = ANY.
+        Spaces are kept, since they are part of a substring search
+        """
+        if self.operator in ("ilike", "iexact"):
+            return value.lower() or None
+        if self.operator == "any":
+            return sorted(set(value))
+        return value
+
+    def params(self, value) -> dict:
+        """
+        Values of the bound parameters of the clause
+        """
+        if self.operator == "ilike":
+            return {self.name: f"%{value}%"}
+        if self.python_type in (date, datetime):
+            day = date.fromisoformat(value)
+            if self.operator == "lte":
+                day += timedelta(days=1)
+            if self.python_type is date:
+                return {self.name: day}
+            start = datetime.combine(day, time.min)
+            if self.operator == "date":
+                return {self.name: start, f"{self.name}__fim": start + timedelta(days=1)}
+            return {self.name: start}
+        return {self.name: value}
+
+
+class FilterSet:
+    """
+    Builds, from the filters declared for a model, the FastAPI dependencies that expose them
+    as query parameters and the SELECT that applies only the supplied ones.
+    The statement is built once per combination of supplied filters and reused with new values
+    """
+    def __init__(self, model, filters: list[Filter]):
+        self.model = model
+        self.filters = {_filter.name: _filter.bind(model)
+                        for declared in filters
+                        for _filter in (declared, *declared.ranges())}
+        self.template = lru_cache(maxsize=config.FILTER_TEMPLATE_CACHE_SIZE)(self._build_template)
+        self.optional = self._build_dependency(required=False)
+        self.required = self._build_dependency(required=True)
+        filter_sets.append(self)
+
+    def _build_dependency(self, required: bool):
+        parameters = [
+            inspect.Parameter(
+                _filter.name,
+                inspect.Parameter.KEYWORD_ONLY,
+                default=Query(None, description=_filter.description, **_filter.query_kwargs),
+                annotation=_filter.annotation,
+            )
+            for _filter in self.filters.values()
+        ]
+
+        async def dependency(**params) -> dict:
+            params = {name: self.filters[name].parse(value) for name, value in params.items()}
+            supplied = {name: value for name, value in params.items() if value is not None}
+            filtros = {name: self.filters[name].canonical(value) for name, value in supplied.items()}
+            filtros = {name: value for name, value in filtros.items() if value is not None}
+            key_stats["requests"] += 1
+            if filtros != supplied:
+                key_stats["normalized"] += 1
+            if required and not filtros:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=config.ERROR_MESSAGE_NO_PARAMS)
+            return filtros
+
+        dependency.__signature__ = inspect.Signature(parameters, return_annotation=dict)
+        dependency.__name__ = f"filtros_{sa_inspect(self.model).local_table.name}"
+        return dependency
+
+    def _build_template(self, names: tuple) -> select:
+        query = select(self.model)
+        if names:
+            query = query.where(and_(*(self.filters[name].clause() for name in names)))
+        return query
+
+    def query(self, filtros: dict) -> tuple[select, dict]:
+        """
+        Returns the cached statement for the supplied filters and the values of its bound parameters,
+        which are passed on execution so the statement (and its SQLAlchemy cache key) is never rebuilt
+        """
+        # Filters are applied in declaration order, so each combination maps to a single SQL text
+        names = tuple(name for name in self.filters if name in filtros)
+        params = {}
+        for name in names:
+            params.update(self.filters[name].params(filtros[name]))
+        return self.template(names), params
+
+
+def template_cache(variants: int):
+    """
+    lru_cache for statements derived from the filter templates of every route, holding `variants`
+    statements for each template of each FilterSet. It is sized on the first call, once the routes
+    have declared their FilterSets
+    """
+    def decorator(func):
+        cached = None
+
+        @wraps(func)
+        def wrapper(*args):
+            nonlocal cached
+            if cached is None:
+                maxsize = max(len(filter_sets), 1) * variants * config.FILTER_TEMPLATE_CACHE_SIZE
+                cached = lru_cache(maxsize=maxsize)(func)
+            return cached(*args)
+        return wrapper
+    return decorator
@@ -0,0 +1,99 @@
+# src/metrics.py
+import asyncio
+import time
+from src.cache import tier_stats, lock_stats, breaker_stats
+from src.database import pool_stats, statement_stats
+from src.stats import LATENCY_BUCKETS, record_counters, worker_gauges, read_stats, read_counters, read_gauges
+
+
+async def watch_event_loop_lag(interval: float = 0.5):
+    """
+    Measures how late the event loop wakes up a task that sleeps for `interval` seconds
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worker_gauges["event_loop_lag_seconds"] = max(time.perf_counter() - started - interval, 0.0)
+
+
+def collect_metrics(db):
+    """
+    Updates the counters and gauges of this worker before each flush of its stats
+    """
+    engine_counters = {f"{name}:{engine}": value
+                       for engine, stats in pool_stats.items() for name, value in stats.items()}
+    record_counters({**tier_stats, **lock_stats, **engine_counters, **statement_stats})
+    engines = {"primary": db.engine} if db.engine is not None else {}
+    engines.update((replica.name, replica.engine) for replica in db.replicas)
+    for name, engine in engines.items():
+        worker_gauges.update({
+            f"db_pool_size:{name}": engine.pool.size(),
+            f"db_pool_checked_out:{name}": engine.pool.checkedout(),
+            f"db_pool_overflow:{name}": max(engine.pool.overflow(), 0),
+        })
+    worker_gauges["cache_breaker_open"] = int(breaker_stats()["state"] in ("open", "half_open"))
+
+
+def by_engine(values: dict, name: str) -> list:
+    """
+    (engine, value) of the counters or gauges recorded as `name:engine`
+    """
+    return [(key.removeprefix(f"{name}:"), value) for key, value in values.items() if key.startswith(f"{name}:")]
+
+
+def metric(lines: list, name: str, kind: str, description: str, samples: list):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} {kind}")
+    for suffix, labels, value in samples:
+        label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels.items())
+        lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text else f"{name}{suffix} {value}")
+
+
+async def render_metrics() -> str:
+    """
+    Prometheus text exposition of the stats shared by all workers
+    """
+    endpoints, _ = await read_stats()
+    counters = await read_counters()
+    gauges_by_pid = await read_gauges()
+    lines = []
+
+    metric(lines, "http_requests_total", "counter", "Requisições por endpoint",
+           [("", {"path": path}, stats["count"]) for path, stats in endpoints.items()])
+    histogram = []
+    for path, stats in endpoints.items():
+        cumulative = 0
+        for bound, amount in zip((*LATENCY_BUCKETS, "+Inf"), stats["latency_buckets"]):
+            cumulative += amount
+            histogram.append(("_bucket", {"path": path, "le": bound}, cumulative))
+        histogram.append(("_sum", {"path": path}, stats["total_time"]))
+        histogram.append(("_count", {"path": path}, stats["count"]))
+    metric(lines, "http_request_duration_seconds", "histogram", "Tempo de resposta por endpoint", histogram)
+
+    metric(lines, "cache_requests_total", "counter", "Consultas ao cache por resultado",
+           [("", {"result": name}, counters.get(name, 0)) for name in tier_stats])
+    metric(lines, "cache_locks_total", "counter", "Tentativas de obter travas do cache por resultado",
+           [("", {"result": name.removeprefix("lock_")}, counters.get(name, 0)) for name in lock_stats])
+    metric(lines, "db_pool_waits_total", "counter", "Conexões obtidas do pool do banco de dados",
+           [("", {"engine": engine}, value) for engine, value in by_engine(counters, "pool_waits")])
+    metric(lines, "db_pool_wait_seconds_total", "counter", "Tempo de espera por conexões do pool do banco de dados",
+           [("", {"engine": engine}, value / 1_000_000) for engine, value in by_engine(counters, "pool_wait_us")])
+    metric(lines, "db_statement_executions_total", "counter", "Comandos executados com prepared statements",
+           [("", {}, counters.get("statement_executions", 0))])
+    metric(lines, "db_statement_prepares_total", "counter", "Prepared statements criados (falhas no cache)",
+           [("", {}, counters.get("statement_prepares", 0))])
+    executions = counters.get("statement_executions", 0)
+    metric(lines, "db_statement_cache_hit_ratio", "gauge", "Taxa de acerto do cache de prepared statements",
+           [("", {}, 1 - counters.get("statement_prepares", 0) / executions if executions else 0.0)])
+
+    for name, description in (("db_pool_size", "Tamanho do pool do banco de dados"),
+                              ("db_pool_checked_out", "Conexões do pool em uso"),
+                              ("db_pool_overflow", "Conexões abertas além do tamanho do pool")):
+        metric(lines, name, "gauge", description,
+               [("", {"pid": pid, "engine": engine}, value)
+                for pid, gauges in gauges_by_pid.items() for engine, value in by_engine(gauges, name)])
+    for name, description in (("cache_breaker_open", "Circuit breaker do servidor de cache aberto"),
+                              ("event_loop_lag_seconds", "Atraso do event loop")):
+        metric(lines, name, "gauge", description,
+               [("", {"pid": pid}, gauges[name]) for pid, gauges in gauges_by_pid.items() if name in gauges])
+    return "\n".join(lines) + "\n"
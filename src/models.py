@@ -1,6 +1,7 @@
 from datetime import date, datetime
 from decimal import Decimal
 from sqlmodel import Field, SQLModel
+from sqlalchemy import Column, Index, func
 from typing import Optional
 
 db_schema = 'api_transferegov_ted'
@@ -214,4 +215,39 @@ class Trf(BaseModel, table=True):
     cd_fonte_recurso_trf: str = Field(primary_key=True)
     cd_categoria_gasto_trf: str = Field(primary_key=True)
     vl_valor_trf: float | None = None
-    cd_situacao_contabil_trf: str | None = None
\ No newline at end of file
+    cd_situacao_contabil_trf: str | None = None
+
+
+# Trigram indexes of the columns searched with ILIKE, declared by the FilterSets of the routes (src/filters.py)
+search_indexes: dict[str, Index] = {}
+
+
+def trgm_index(column: Column) -> Index:
+    """
+    GIN index with pg_trgm operators, which lets ILIKE '%x%' filters on the column use an index scan.
+    It is kept out of the table metadata, so create_all doesn't depend on the extension
+    """
+    name = f"ix_{column.table.name}_{column.name}_trgm"
+    if name not in search_indexes:
+        index = Index(name, column, postgresql_using="gin", postgresql_ops={column.name: "gin_trgm_ops"})
+        column.table.indexes.discard(index)
+        search_indexes[name] = index
+    return search_indexes[name]
+
+
+# B-tree indexes on lower(column), for the columns compared case-insensitively with iexact filters
+lower_indexes: dict[str, Index] = {}
+
+
+def lower_index(column: Column) -> Index:
+    name = f"ix_{column.table.name}_{column.name}_lower"
+    if name not in lower_indexes:
+        lower_indexes[name] = Index(name, func.lower(column))
+    return lower_indexes[name]
+
+
+# Columns with _de/_ate range filters in the routes, indexed so a range is a single index scan
+range_indexes = [Index(f"ix_{table.name}_{column.name}", column)
+                 for table in SQLModel.metadata.tables.values()
+                 for column in table.c
+                 if column.name.startswith(("dt_", "dh_", "vl_"))]
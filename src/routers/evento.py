@@ -1,16 +1,30 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select, and_, cast, Date
 from src import models
 from src.utils import get_session, get_paginated_data, config
 from src.schemas import PaginatedResponseTemplate, PaginatedEventoResponse
-from datetime import date
+from src.filters import Filter, FilterSet
 from typing import Optional
-from src.cache import cache
+from src.cache import page_cache
+from src.export import export_data, FormatoExportacao
 
 
 evt_router = APIRouter(tags=["Evento"])
 
+filtros_evento = FilterSet(models.Evento, [
+    Filter("id_nota", "Identificador Único da Nota de Crédito"),
+    Filter("cd_evento", "Código do Evento"),
+    Filter("cd_ptres_evento", "Código PTRES do Evento"),
+    Filter("cd_fonte_recurso_evento", "Código da Fonte de Recurso do Evento"),
+    Filter("cd_plano_interno_evento", "Código do Plano Interno do Evento"),
+    Filter("vl_evento", "Valor do Evento"),
+    Filter("cd_ug_responsavel_evento", "Código da Unidade Gestora Responsável do Evento"),
+    Filter("codigo_natureza", "Código de Natureza do Evento"),
+    Filter("descricao_natureza", "Descrição de Natureza do Evento", operator="ilike"),
+    Filter("nome_esfera_orcamentaria", "Nome da Esfera Orçamentária do Evento", operator="ilike")
+])
+
 
 @evt_router.get("/evento",
                 status_code=status.HTTP_200_OK,
@@ -18,51 +32,44 @@ evt_router = APIRouter(tags=["Evento"])
                 response_description="Lista Paginada de Eventos relativos aos Planos de Ação - TED",
                 response_model=PaginatedEventoResponse
                 )
-@cache(ttl=config.CACHE_TTL, lock=True)
+@page_cache(ttl=config.CACHE_TTL, soft_ttl=config.CACHE_SOFT_TTL, route="evento")
 async def consulta_evento_ted(
-    id_nota: Optional[int] = Query(None, description="Identificador Único da Nota de Crédito"),
-    cd_evento: Optional[str] = Query(None, description="Código do Evento"),
-    cd_ptres_evento: Optional[str] = Query(None, description="Código PTRES do Evento"),
-    cd_fonte_recurso_evento: Optional[str] = Query(None, description="Código da Fonte de Recurso do Evento"),
-    cd_plano_interno_evento: Optional[str] = Query(None, description="Código do Plano Interno do Evento"),
-    vl_evento: Optional[float] = Query(None, description="Valor do Evento"),
-    cd_ug_responsavel_evento: Optional[str] = Query(None, description="Código da Unidade Gestora Responsável do Evento"),
-    codigo_natureza: Optional[str] = Query(None, description="Código de Natureza do Evento"),
-    descricao_natureza: Optional[str] = Query(None, description="Descrição de Natureza do Evento"),
-    nome_esfera_orcamentaria: Optional[str] = Query(None, description="Nome da Esfera Orçamentária do Evento"),
+    filtros: dict = Depends(filtros_evento.required),
     pagina: int = Query(1, ge=1, description="Número da Página"),
     tamanho_da_pagina: int = Query(config.DEFAULT_PAGE_SIZE, le=config.MAX_PAGE_SIZE, ge=1, description="Tamanho da Página"),
+    cursor: Optional[str] = Query(None, description="Cursor da Próxima Página (paginação por chave)"),
+    incluir_total: bool = Query(True, description="Inclui a Contagem Total de Registros"),
     dbsession: AsyncSession = Depends(get_session)
 ):
-    params = locals().copy()
-    params_list = list(params.keys())[:-3]    
-    
-    if all([params[_name] is None for _name in params_list]):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=config.ERROR_MESSAGE_NO_PARAMS)
-    
     try:
-        query = select(models.Evento).where(
-            and_(
-                models.Evento.id_nota == id_nota if id_nota is not None else True,
-                models.Evento.cd_evento == cd_evento if cd_evento is not None else True,
-                models.Evento.cd_ptres_evento == cd_ptres_evento if cd_ptres_evento is not None else True,
-                models.Evento.cd_fonte_recurso_evento == cd_fonte_recurso_evento if cd_fonte_recurso_evento is not None else True,
-                models.Evento.cd_plano_interno_evento == cd_plano_interno_evento if cd_plano_interno_evento is not None else True,
-                models.Evento.vl_evento == vl_evento if vl_evento is not None else True,
-                models.Evento.cd_ug_responsavel_evento == cd_ug_responsavel_evento if cd_ug_responsavel_evento is not None else True,
-                models.Evento.codigo_natureza == codigo_natureza if codigo_natureza is not None else True,
-                models.Evento.descricao_natureza.ilike(f"%{descricao_natureza}%") if descricao_natureza is not None else True,
-                models.Evento.nome_esfera_orcamentaria.ilike(f"%{nome_esfera_orcamentaria}%") if nome_esfera_orcamentaria is not None else True
-            )
-        )
+        query, params = filtros_evento.query(filtros)
         result = await get_paginated_data(query=query,
+                                          params=params,
                                           dbsession=dbsession,
                                           response_schema=PaginatedResponseTemplate, 
                                           current_page=pagina, 
-                                          records_per_page=tamanho_da_pagina)
+                                          records_per_page=tamanho_da_pagina,
+                                          cursor=cursor,
+                                          include_total=incluir_total)
         return result
     
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=config.ERROR_MESSAGE_INTERNAL)
\ No newline at end of file
+                            detail=config.ERROR_MESSAGE_INTERNAL)
+
+
+@evt_router.get("/evento/export",
+                status_code=status.HTTP_200_OK,
+                description="Exporta em NDJSON, CSV, Arrow ou Parquet os dados de Evento - TED.",
+                response_description="Arquivo de Eventos relativos aos Planos de Ação - TED",
+                response_class=StreamingResponse
+                )
+async def exporta_evento_ted(
+    filtros: dict = Depends(filtros_evento.optional),
+    formato: FormatoExportacao = Query(FormatoExportacao.ndjson, description="Formato do Arquivo Exportado")
+):
+    query, params = filtros_evento.query(filtros)
+    return export_data(query=query, params=params, export_format=formato, file_name="evento")
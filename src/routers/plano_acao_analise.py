@@ -1,56 +1,70 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select, and_, cast, Date
 from src import models
 from src.utils import get_session, get_paginated_data, config
 from src.schemas import PaginatedResponseTemplate, PaginatedPlanoAcaoAnaliseResponse
-from datetime import date
+from src.filters import Filter, FilterSet
 from typing import Optional
-from src.cache import cache
+from src.cache import page_cache
+from src.export import export_data, FormatoExportacao
+
 
 paa_router = APIRouter(tags=["Plano de Ação - Análise"])
 
+filtros_plano_acao_analise = FilterSet(models.PlanoAcaoAnalise, [
+    Filter("id_plano_acao", "Identificador Único do Plano de Ação"),
+    Filter("id_analise", "Identificador Único da Análise"),
+    Filter("tx_justificativa_analise", "Justificativa da Análise do Plano de Ação", operator="ilike"),
+    Filter("resultado_analise", "Resultado da Análise do Plano de Ação", operator="ilike"),
+    Filter("tx_situacao_analise", "Situação da Análise do Plano de Ação", operator="ilike")
+])
+
+
 @paa_router.get("/plano_acao_analise",
                 status_code=status.HTTP_200_OK,
                 description="Retorna uma Lista Paginada dos dados das Análises dos Planos de Ação - TED.",
                 response_description="Lista Paginada de Análises relativas aos Planos de Ação - TED",
                 response_model=PaginatedPlanoAcaoAnaliseResponse
                 )
-@cache(ttl=config.CACHE_TTL, lock=True)
+@page_cache(ttl=config.CACHE_TTL, soft_ttl=config.CACHE_SOFT_TTL, route="plano_acao_analise")
 async def consulta_analise_plano_acao_ted(
-    id_plano_acao: Optional[int] = Query(None, description="Identificador Único do Plano de Ação"),
-    id_analise: Optional[int] = Query(None, description="Identificador Único da Análise"),
-    tx_justificativa_analise: Optional[str] = Query(None, description="Justificativa da Análise do Plano de Ação"),
-    resultado_analise: Optional[str] = Query(None, description="Resultado da Análise do Plano de Ação"),
-    tx_situacao_analise: Optional[str] = Query(None, description="Situação da Análise do Plano de Ação"),
+    filtros: dict = Depends(filtros_plano_acao_analise.required),
     pagina: int = Query(1, ge=1, description="Número da Página"),
     tamanho_da_pagina: int = Query(config.DEFAULT_PAGE_SIZE, le=config.MAX_PAGE_SIZE, ge=1, description="Tamanho da Página"),
+    cursor: Optional[str] = Query(None, description="Cursor da Próxima Página (paginação por chave)"),
+    incluir_total: bool = Query(True, description="Inclui a Contagem Total de Registros"),
     dbsession: AsyncSession = Depends(get_session)
 ):
-    params = locals().copy()
-    params_list = list(params.keys())[:-3]    
-    
-    if all([params[_name] is None for _name in params_list]):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=config.ERROR_MESSAGE_NO_PARAMS)
-    
     try:
-        query = select(models.PlanoAcaoAnalise).where(
-            and_(
-                models.PlanoAcaoAnalise.id_plano_acao == id_plano_acao if id_plano_acao is not None else True,
-                models.PlanoAcaoAnalise.id_analise == id_analise if id_analise is not None else True,
-                models.PlanoAcaoAnalise.tx_justificativa_analise.ilike(f"%{tx_justificativa_analise}%") if tx_justificativa_analise is not None else True,
-                models.PlanoAcaoAnalise.resultado_analise.ilike(f"%{resultado_analise}%") if resultado_analise is not None else True,
-                models.PlanoAcaoAnalise.tx_situacao_analise.ilike(f"%{tx_situacao_analise}%") if tx_situacao_analise is not None else True
-            )
-        )
+        query, params = filtros_plano_acao_analise.query(filtros)
         result = await get_paginated_data(query=query,
+                                          params=params,
                                           dbsession=dbsession,
                                           response_schema=PaginatedResponseTemplate, 
                                           current_page=pagina, 
-                                          records_per_page=tamanho_da_pagina)
+                                          records_per_page=tamanho_da_pagina,
+                                          cursor=cursor,
+                                          include_total=incluir_total)
         return result
     
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=config.ERROR_MESSAGE_INTERNAL)
\ No newline at end of file
+                            detail=config.ERROR_MESSAGE_INTERNAL)
+
+
+@paa_router.get("/plano_acao_analise/export",
+                status_code=status.HTTP_200_OK,
+                description="Exporta em NDJSON, CSV, Arrow ou Parquet os dados das Análises dos Planos de Ação - TED.",
+                response_description="Arquivo de Análises relativas aos Planos de Ação - TED",
+                response_class=StreamingResponse
+                )
+async def exporta_analise_plano_acao_ted(
+    filtros: dict = Depends(filtros_plano_acao_analise.optional),
+    formato: FormatoExportacao = Query(FormatoExportacao.ndjson, description="Formato do Arquivo Exportado")
+):
+    query, params = filtros_plano_acao_analise.query(filtros)
+    return export_data(query=query, params=params, export_format=formato, file_name="plano_acao_analise")
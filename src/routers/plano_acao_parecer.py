@@ -1,60 +1,72 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select, and_, cast, Date
 from src import models
 from src.utils import get_session, get_paginated_data, config
 from src.schemas import PaginatedResponseTemplate, PaginatedPlanoAcaoParecerResponse
-from datetime import date
+from src.filters import Filter, FilterSet
 from typing import Optional
-from src.cache import cache
+from src.cache import page_cache
+from src.export import export_data, FormatoExportacao
+
 
 pap_router = APIRouter(tags=["Plano de Ação - Parecer"])
 
+filtros_plano_acao_parecer = FilterSet(models.PlanoAcaoParecer, [
+    Filter("id_plano_acao", "Identificador Único do Plano de Ação"),
+    Filter("id_parecer", "Identificador Único do Parecer"),
+    Filter("tp_analise_parecer", "Tipo da Análise do Parecer do Plano de Ação", operator="ilike"),
+    Filter("resultado_parecer", "Resultado do Parecer do Plano de Ação", operator="ilike"),
+    Filter("tx_parecer", "Parecer do Plano de Ação", operator="ilike"),
+    Filter("plano_acao_hist_fk", "Número do Histórico do Plano de Ação"),
+    Filter("dt_data_parecer", "Data do Parecer do Plano de Ação")
+])
+
+
 @pap_router.get("/plano_acao_parecer",
                 status_code=status.HTTP_200_OK,
                 description="Retorna uma Lista Paginada dos dados dos Pareceres dos Planos de Ação - TED.",
                 response_description="Lista Paginada de Pareceres relativas aos Planos de Ação - TED",
                 response_model=PaginatedPlanoAcaoParecerResponse
                 )
-@cache(ttl=config.CACHE_TTL, lock=True)
+@page_cache(ttl=config.CACHE_TTL, soft_ttl=config.CACHE_SOFT_TTL, route="plano_acao_parecer")
 async def consulta_parecer_plano_acao_ted(
-    id_plano_acao: Optional[int] = Query(None, description="Identificador Único do Plano de Ação"),
-    id_parecer: Optional[int] = Query(None, description="Identificador Único do Parecer"),
-    tp_analise_parecer: Optional[str] = Query(None, description="Tipo da Análise do Parecer do Plano de Ação"),
-    resultado_parecer: Optional[str] = Query(None, description="Resultado do Parecer do Plano de Ação"),
-    tx_parecer: Optional[str] = Query(None, description="Parecer do Plano de Ação"),
-    plano_acao_hist_fk: Optional[int] = Query(None, description="Número do Histórico do Plano de Ação"),
-    dt_data_parecer: Optional[str] = Query(None, description="Data do Parecer do Plano de Ação", pattern="^\d{4}-\d{2}-\d{2}$"),
+    filtros: dict = Depends(filtros_plano_acao_parecer.required),
     pagina: int = Query(1, ge=1, description="Número da Página"),
     tamanho_da_pagina: int = Query(config.DEFAULT_PAGE_SIZE, le=config.MAX_PAGE_SIZE, ge=1, description="Tamanho da Página"),
+    cursor: Optional[str] = Query(None, description="Cursor da Próxima Página (paginação por chave)"),
+    incluir_total: bool = Query(True, description="Inclui a Contagem Total de Registros"),
     dbsession: AsyncSession = Depends(get_session)
 ):
-    params = locals().copy()
-    params_list = list(params.keys())[:-3]    
-    
-    if all([params[_name] is None for _name in params_list]):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=config.ERROR_MESSAGE_NO_PARAMS)
-    
     try:
-        query = select(models.PlanoAcaoParecer).where(
-            and_(
-                models.PlanoAcaoParecer.id_plano_acao == id_plano_acao if id_plano_acao is not None else True,
-                models.PlanoAcaoParecer.id_parecer == id_parecer if id_parecer is not None else True,
-                models.PlanoAcaoParecer.tp_analise_parecer.ilike(f"%{tp_analise_parecer}%") if tp_analise_parecer is not None else True,
-                models.PlanoAcaoParecer.resultado_parecer.ilike(f"%{resultado_parecer}%") if resultado_parecer is not None else True,
-                models.PlanoAcaoParecer.tx_parecer.ilike(f"%{tx_parecer}%") if tx_parecer is not None else True,
-                models.PlanoAcaoParecer.plano_acao_hist_fk == plano_acao_hist_fk if plano_acao_hist_fk is not None else True,
-                cast(models.PlanoAcaoParecer.dt_data_parecer, Date) == date.fromisoformat(dt_data_parecer) if dt_data_parecer is not None else True
-            )
-        )
+        query, params = filtros_plano_acao_parecer.query(filtros)
         result = await get_paginated_data(query=query,
+                                          params=params,
                                           dbsession=dbsession,
                                           response_schema=PaginatedResponseTemplate, 
                                           current_page=pagina, 
-                                          records_per_page=tamanho_da_pagina)
+                                          records_per_page=tamanho_da_pagina,
+                                          cursor=cursor,
+                                          include_total=incluir_total)
         return result
     
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=config.ERROR_MESSAGE_INTERNAL)
\ No newline at end of file
+                            detail=config.ERROR_MESSAGE_INTERNAL)
+
+
+@pap_router.get("/plano_acao_parecer/export",
+                status_code=status.HTTP_200_OK,
+                description="Exporta em NDJSON, CSV, Arrow ou Parquet os dados dos Pareceres dos Planos de Ação - TED.",
+                response_description="Arquivo de Pareceres relativas aos Planos de Ação - TED",
+                response_class=StreamingResponse
+                )
+async def exporta_parecer_plano_acao_ted(
+    filtros: dict = Depends(filtros_plano_acao_parecer.optional),
+    formato: FormatoExportacao = Query(FormatoExportacao.ndjson, description="Formato do Arquivo Exportado")
+):
+    query, params = filtros_plano_acao_parecer.query(filtros)
+    return export_data(query=query, params=params, export_format=formato, file_name="plano_acao_parecer")
@@ -1,14 +1,23 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select, and_, cast, Date
 from src import models
 from src.utils import get_session, get_paginated_data, config
 from src.schemas import PaginatedResponseTemplate, PaginatedProgramaAcaoOrcamentariaResponse
+from src.filters import Filter, FilterSet
 from typing import Optional
-from src.cache import cache
+from src.cache import page_cache
+from src.export import export_data, FormatoExportacao
+
 
 pgao_router = APIRouter(tags=["Programa - Ação Orçamentária"])
 
+filtros_programa_acao_orcamentaria = FilterSet(models.ProgramaAcaoOrcamentaria, [
+    Filter("tx_codigo_acao_orcamentaria", "Código da Ação Orçamentária"),
+    Filter("tx_descricao_acao_orcamentaria", "Descrição do Programa da Ação Ornamentária", operator="ilike"),
+    Filter("id_programa", "Identificador Único do Programa")
+])
+
 
 @pgao_router.get("/programa_acao_orcamentaria",
                 status_code=status.HTTP_200_OK,
@@ -16,37 +25,44 @@ pgao_router = APIRouter(tags=["Programa - Ação Orçamentária"])
                 response_description="Lista Paginada de Ações Orçamentárias dos Programas - TED",
                 response_model=PaginatedProgramaAcaoOrcamentariaResponse
                 )
-@cache(ttl=config.CACHE_TTL, lock=True)
+@page_cache(ttl=config.CACHE_TTL, soft_ttl=config.CACHE_SOFT_TTL, route="programa_acao_orcamentaria")
 async def consulta_programa_acao_orcamentaria_ted(
-    tx_codigo_acao_orcamentaria: Optional[str] = Query(None, description="Código da Ação Orçamentária"),
-    tx_descricao_acao_orcamentaria: Optional[str] = Query(None, description="Descrição do Programa da Ação Ornamentária"),
-    id_programa: Optional[int] = Query(None, description="Identificador Único do Programa"),
+    filtros: dict = Depends(filtros_programa_acao_orcamentaria.required),
     pagina: int = Query(1, ge=1, description="Número da Página"),
     tamanho_da_pagina: int = Query(config.DEFAULT_PAGE_SIZE, le=config.MAX_PAGE_SIZE, ge=1, description="Tamanho da Página"),
+    cursor: Optional[str] = Query(None, description="Cursor da Próxima Página (paginação por chave)"),
+    incluir_total: bool = Query(True, description="Inclui a Contagem Total de Registros"),
     dbsession: AsyncSession = Depends(get_session)
 ):
-    params = locals().copy()
-    params_list = list(params.keys())[:-3]    
-    
-    if all([params[_name] is None for _name in params_list]):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=config.ERROR_MESSAGE_NO_PARAMS)
-    
     try:
-        query = select(models.ProgramaAcaoOrcamentaria).where(
-            and_(
-                models.ProgramaAcaoOrcamentaria.tx_codigo_acao_orcamentaria == tx_codigo_acao_orcamentaria if tx_codigo_acao_orcamentaria else True,
-                models.ProgramaAcaoOrcamentaria.tx_descricao_acao_orcamentaria.ilike(f"%{tx_descricao_acao_orcamentaria}%") if tx_descricao_acao_orcamentaria else True,
-                models.ProgramaAcaoOrcamentaria.id_programa == id_programa if id_programa else True
-            )
-        )
+        query, params = filtros_programa_acao_orcamentaria.query(filtros)
         result = await get_paginated_data(query=query,
+                                          params=params,
                                           dbsession=dbsession,
                                           response_schema=PaginatedResponseTemplate, 
                                           current_page=pagina, 
-                                          records_per_page=tamanho_da_pagina)
+                                          records_per_page=tamanho_da_pagina,
+                                          cursor=cursor,
+                                          include_total=incluir_total)
         return result
     
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=config.ERROR_MESSAGE_INTERNAL)
\ No newline at end of file
+                            detail=config.ERROR_MESSAGE_INTERNAL)
+
+
+@pgao_router.get("/programa_acao_orcamentaria/export",
+                status_code=status.HTTP_200_OK,
+                description="Exporta em NDJSON, CSV, Arrow ou Parquet os dados das Ações Orçamentárias dos Programas - TED.",
+                response_description="Arquivo de Ações Orçamentárias dos Programas - TED",
+                response_class=StreamingResponse
+                )
+async def exporta_programa_acao_orcamentaria_ted(
+    filtros: dict = Depends(filtros_programa_acao_orcamentaria.optional),
+    formato: FormatoExportacao = Query(FormatoExportacao.ndjson, description="Formato do Arquivo Exportado")
+):
+    query, params = filtros_programa_acao_orcamentaria.query(filtros)
+    return export_data(query=query, params=params, export_format=formato, file_name="programa_acao_orcamentaria")
@@ -1,15 +1,23 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select, and_, cast, Date
 from src import models
-from src.utils import get_session, get_paginated_data
+from src.utils import get_session, get_paginated_data, config
 from src.schemas import PaginatedResponseTemplate, PaginatedProgramaBeneficiarioResponse
+from src.filters import Filter, FilterSet
 from typing import Optional
-from appconfig import Settings
-from src.cache import cache
+from src.cache import page_cache
+from src.export import export_data, FormatoExportacao
+
 
 pgb_router = APIRouter(tags=["Programa - Beneficiário"])
-config = Settings()
+
+filtros_programa_beneficiario = FilterSet(models.ProgramaBeneficiario, [
+    Filter("tx_codigo_siorg", "Código SIORG"),
+    Filter("tx_nome_beneficiario", "Nome do Beneficiário", operator="ilike"),
+    Filter("vl_valor_beneficiario", "Valor do Beneficiário"),
+    Filter("id_programa", "Identificador Único do Programa")
+])
 
 
 @pgb_router.get("/programa_beneficiario",
@@ -18,39 +26,44 @@ config = Settings()
                 response_description="Lista Paginada de Beneficiários dos Programas - TED",
                 response_model=PaginatedProgramaBeneficiarioResponse
                 )
-@cache(ttl=config.CACHE_TTL, lock=True)
+@page_cache(ttl=config.CACHE_TTL, soft_ttl=config.CACHE_SOFT_TTL, route="programa_beneficiario")
 async def consulta_programa_beneficiario_ted(
-    tx_codigo_siorg: Optional[str] = Query(None, description="Código SIORG"),
-    tx_nome_beneficiario: Optional[str] = Query(None, description="Nome do Beneficiário"),
-    vl_valor_beneficiario: Optional[float] = Query(None, description="Valor do Beneficiário"),
-    id_programa: Optional[int] = Query(None, description="Identificador Único do Programa"),
+    filtros: dict = Depends(filtros_programa_beneficiario.required),
     pagina: int = Query(1, ge=1, description="Número da Página"),
     tamanho_da_pagina: int = Query(config.DEFAULT_PAGE_SIZE, le=config.MAX_PAGE_SIZE, ge=1, description="Tamanho da Página"),
+    cursor: Optional[str] = Query(None, description="Cursor da Próxima Página (paginação por chave)"),
+    incluir_total: bool = Query(True, description="Inclui a Contagem Total de Registros"),
     dbsession: AsyncSession = Depends(get_session)
 ):
-    params = locals().copy()
-    params_list = list(params.keys())[:-3]    
-    
-    if all([params[_name] is None for _name in params_list]):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=config.ERROR_MESSAGE_NO_PARAMS)
-    
     try:
-        query = select(models.ProgramaBeneficiario).where(
-            and_(
-                models.ProgramaBeneficiario.tx_codigo_siorg == tx_codigo_siorg if tx_codigo_siorg else True,
-                models.ProgramaBeneficiario.tx_nome_beneficiario.ilike(f"%{tx_nome_beneficiario}%") if tx_nome_beneficiario else True,
-                models.ProgramaBeneficiario.vl_valor_beneficiario == vl_valor_beneficiario if vl_valor_beneficiario else True,
-                models.ProgramaBeneficiario.id_programa == id_programa if id_programa else True
-            )
-        )
+        query, params = filtros_programa_beneficiario.query(filtros)
         result = await get_paginated_data(query=query,
+                                          params=params,
                                           dbsession=dbsession,
                                           response_schema=PaginatedResponseTemplate, 
                                           current_page=pagina, 
-                                          records_per_page=tamanho_da_pagina)
+                                          records_per_page=tamanho_da_pagina,
+                                          cursor=cursor,
+                                          include_total=incluir_total)
         return result
     
-    except Exception as e:        
+    except HTTPException:
+        raise
+
+    except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=config.ERROR_MESSAGE_INTERNAL)
\ No newline at end of file
+                            detail=config.ERROR_MESSAGE_INTERNAL)
+
+
+@pgb_router.get("/programa_beneficiario/export",
+                status_code=status.HTTP_200_OK,
+                description="Exporta em NDJSON, CSV, Arrow ou Parquet os dados dos Beneficiários dos Programas - TED.",
+                response_description="Arquivo de Beneficiários dos Programas - TED",
+                response_class=StreamingResponse
+                )
+async def exporta_programa_beneficiario_ted(
+    filtros: dict = Depends(filtros_programa_beneficiario.optional),
+    formato: FormatoExportacao = Query(FormatoExportacao.ndjson, description="Formato do Arquivo Exportado")
+):
+    query, params = filtros_programa_beneficiario.query(filtros)
+    return export_data(query=query, params=params, export_format=formato, file_name="programa_beneficiario")
@@ -1,66 +1,75 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select, and_, cast, Date
 from src import models
 from src.utils import get_session, get_paginated_data, config
 from src.schemas import PaginatedResponseTemplate, PaginatedTermoExecucaoResponse
-from datetime import date
+from src.filters import Filter, FilterSet
 from typing import Optional
-from src.cache import cache
+from src.cache import page_cache
+from src.export import export_data, FormatoExportacao
+
 
 tde_router = APIRouter(tags=["Termo de Execução"])
 
+filtros_termo_execucao = FilterSet(models.TermoExecucao, [
+    Filter("id_termo", "Identificador Único do Termo"),
+    Filter("id_plano_acao", "Identificador Único do Plano de Ação"),
+    Filter("tx_situacao_termo", "Situação do Termo de Execução", operator="ilike"),
+    Filter("tx_num_processo_sei", "Número do Processo SEI de Execução", operator="ilike"),
+    Filter("dt_assinatura_termo", "Data de Assinatura do Termo de Execução"),
+    Filter("dt_divulgacao_termo", "Data de Divulgação do Termo de Execução"),
+    Filter("in_minuta_padrao", "Indicador Minuta Padrão do Termo de Execução"),
+    Filter("tx_numero_ns_termo", "Número NS do Termo de Execução"),
+    Filter("dt_recebimento_termo", "Data do Recebimento do Termo de Execução"),
+    Filter("dt_efetivacao_termo", "Data da Efetivação do Termo de Execução")
+])
+
+
 @tde_router.get("/termo_execucao",
                 status_code=status.HTTP_200_OK,
                 description="Retorna uma Lista Paginada dos dados dos Termos de Execução - TED.",
                 response_description="Lista Paginada de Termos de Execução relativas aos Planos de Ação - TED",
                 response_model=PaginatedTermoExecucaoResponse
                 )
-@cache(ttl=config.CACHE_TTL, lock=True)
+@page_cache(ttl=config.CACHE_TTL, soft_ttl=config.CACHE_SOFT_TTL, route="termo_execucao")
 async def consulta_termo_execucao_ted(
-    id_termo: Optional[int] = Query(None, description="Identificador Único do Termo"),
-    id_plano_acao: Optional[int] = Query(None, description="Identificador Único do Plano de Ação"),
-    tx_situacao_termo: Optional[str] = Query(None, description="Situação do Termo de Execução"),
-    tx_num_processo_sei: Optional[str] = Query(None, description="Número do Processo SEI de Execução"),
-    dt_assinatura_termo: Optional[str] = Query(None, description="Data de Assinatura do Termo de Execução", pattern="^\d{4}-\d{2}-\d{2}$"),
-    dt_divulgacao_termo: Optional[str] = Query(None, description="Data de Divulgação do Termo de Execução", pattern="^\d{4}-\d{2}-\d{2}$"),
-    in_minuta_padrao: Optional[bool] = Query(None, description="Indicador Minuta Padrão do Termo de Execução"),
-    tx_numero_ns_termo: Optional[str] = Query(None, description="Número NS do Termo de Execução"),
-    dt_recebimento_termo: Optional[str] = Query(None, description="Data do Recebimento do Termo de Execução", pattern="^\d{4}-\d{2}-\d{2}$"),
-    dt_efetivacao_termo: Optional[str] = Query(None, description="Data da Efetivação do Termo de Execução", pattern="^\d{4}-\d{2}-\d{2}$"),
+    filtros: dict = Depends(filtros_termo_execucao.required),
     pagina: int = Query(1, ge=1, description="Número da Página"),
     tamanho_da_pagina: int = Query(config.DEFAULT_PAGE_SIZE, le=config.MAX_PAGE_SIZE, ge=1, description="Tamanho da Página"),
+    cursor: Optional[str] = Query(None, description="Cursor da Próxima Página (paginação por chave)"),
+    incluir_total: bool = Query(True, description="Inclui a Contagem Total de Registros"),
     dbsession: AsyncSession = Depends(get_session)
 ):
-    params = locals().copy()
-    params_list = list(params.keys())[:-3]    
-    
-    if all([params[_name] is None for _name in params_list]):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=config.ERROR_MESSAGE_NO_PARAMS)
-    
     try:
-        query = select(models.TermoExecucao).where(
-            and_(
-                models.TermoExecucao.id_termo == id_termo if id_termo is not None else True,
-                models.TermoExecucao.id_plano_acao == id_plano_acao if id_plano_acao is not None else True,
-                models.TermoExecucao.tx_situacao_termo.ilike(f"%{tx_situacao_termo}%") if tx_situacao_termo is not None else True,
-                models.TermoExecucao.tx_num_processo_sei.ilike(f"%{tx_num_processo_sei}%") if tx_num_processo_sei is not None else True,
-                cast(models.TermoExecucao.dt_assinatura_termo, Date) == date.fromisoformat(dt_assinatura_termo) if dt_assinatura_termo is not None else True,
-                cast(models.TermoExecucao.dt_divulgacao_termo, Date) == date.fromisoformat(dt_divulgacao_termo) if dt_divulgacao_termo is not None else True,
-                models.TermoExecucao.in_minuta_padrao == in_minuta_padrao if in_minuta_padrao is not None else True,
-                models.TermoExecucao.tx_numero_ns_termo == tx_numero_ns_termo if tx_numero_ns_termo is not None else True,
-                cast(models.TermoExecucao.dt_recebimento_termo, Date) == date.fromisoformat(dt_recebimento_termo) if dt_recebimento_termo is not None else True,
-                cast(models.TermoExecucao.dt_efetivacao_termo, Date) == date.fromisoformat(dt_efetivacao_termo) if dt_efetivacao_termo is not None else True
-            )
-        )
+        query, params = filtros_termo_execucao.query(filtros)
         result = await get_paginated_data(query=query,
+                                          params=params,
                                           dbsession=dbsession,
                                           response_schema=PaginatedResponseTemplate, 
                                           current_page=pagina, 
-                                          records_per_page=tamanho_da_pagina)
+                                          records_per_page=tamanho_da_pagina,
+                                          cursor=cursor,
+                                          include_total=incluir_total)
         return result
     
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=config.ERROR_MESSAGE_INTERNAL)
\ No newline at end of file
+                            detail=config.ERROR_MESSAGE_INTERNAL)
+
+
+@tde_router.get("/termo_execucao/export",
+                status_code=status.HTTP_200_OK,
+                description="Exporta em NDJSON, CSV, Arrow ou Parquet os dados dos Termos de Execução - TED.",
+                response_description="Arquivo de Termos de Execução relativas aos Planos de Ação - TED",
+                response_class=StreamingResponse
+                )
+async def exporta_termo_execucao_ted(
+    filtros: dict = Depends(filtros_termo_execucao.optional),
+    formato: FormatoExportacao = Query(FormatoExportacao.ndjson, description="Formato do Arquivo Exportado")
+):
+    query, params = filtros_termo_execucao.query(filtros)
+    return export_data(query=query, params=params, export_format=formato, file_name="termo_execucao")
@@ -1,16 +1,26 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import select, and_, cast, Date
 from src import models
 from src.utils import get_session, get_paginated_data, config
 from src.schemas import PaginatedResponseTemplate, PaginatedTrfResponse
-from datetime import date
+from src.filters import Filter, FilterSet
 from typing import Optional
-from src.cache import cache
+from src.cache import page_cache
+from src.export import export_data, FormatoExportacao
 
 
 trf_router = APIRouter(tags=["TRF"])
 
+filtros_trf = FilterSet(models.Trf, [
+    Filter("id_programacao", "Identificador Único Programação Financeira"),
+    Filter("cd_vinculacao_trf", "Código de Vinculação TRF"),
+    Filter("cd_fonte_recurso_trf", "Código de Fonte Recurso do TRF"),
+    Filter("cd_categoria_gasto_trf", "Código Categoria Gasto TRF"),
+    Filter("vl_valor_trf", "Valor do TRF"),
+    Filter("cd_situacao_contabil_trf", "Código de Situação Contábil do TRF", operator="ilike")
+])
+
 
 @trf_router.get("/trf",
                 status_code=status.HTTP_200_OK,
@@ -18,43 +28,44 @@ trf_router = APIRouter(tags=["TRF"])
                 response_description="Lista Paginada de TRFs - TED",
                 response_model=PaginatedTrfResponse
                 )
-@cache(ttl=config.CACHE_TTL, lock=True)
+@page_cache(ttl=config.CACHE_TTL, soft_ttl=config.CACHE_SOFT_TTL, route="trf")
 async def consulta_trf_ted(
-    id_programacao: Optional[int] = Query(None, description="Identificador Único Programação Financeira"),
-    cd_vinculacao_trf: Optional[int] = Query(None, description="Código de Vinculação TRF"),
-    cd_fonte_recurso_trf: Optional[str] = Query(None, description="Código de Fonte Recurso do TRF"),
-    cd_categoria_gasto_trf: Optional[str] = Query(None, description="Código Categoria Gasto TRF"),
-    vl_valor_trf: Optional[float] = Query(None, description="Valor do TRF"),
-    cd_situacao_contabil_trf: Optional[str] = Query(None, description="Código de Situação Contábil do TRF"),
+    filtros: dict = Depends(filtros_trf.required),
     pagina: int = Query(1, ge=1, description="Número da Página"),
     tamanho_da_pagina: int = Query(config.DEFAULT_PAGE_SIZE, le=config.MAX_PAGE_SIZE, ge=1, description="Tamanho da Página"),
+    cursor: Optional[str] = Query(None, description="Cursor da Próxima Página (paginação por chave)"),
+    incluir_total: bool = Query(True, description="Inclui a Contagem Total de Registros"),
     dbsession: AsyncSession = Depends(get_session)
 ):
-    params = locals().copy()
-    params_list = list(params.keys())[:-3]    
-    
-    if all([params[_name] is None for _name in params_list]):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=config.ERROR_MESSAGE_NO_PARAMS)
-    
     try:
-        query = select(models.Trf).where(
-            and_(
-                models.Trf.id_programacao == id_programacao if id_programacao is not None else True,
-                models.Trf.cd_vinculacao_trf == cd_vinculacao_trf if cd_vinculacao_trf is not None else True,
-                models.Trf.cd_fonte_recurso_trf == cd_fonte_recurso_trf if cd_fonte_recurso_trf is not None else True,
-                models.Trf.cd_categoria_gasto_trf == cd_categoria_gasto_trf if cd_categoria_gasto_trf is not None else True,
-                models.Trf.vl_valor_trf == vl_valor_trf if vl_valor_trf is not None else True,
-                models.Trf.cd_situacao_contabil_trf.ilike(f"%{cd_situacao_contabil_trf}%") if cd_situacao_contabil_trf is not None else True
-            )
-        )
+        query, params = filtros_trf.query(filtros)
         result = await get_paginated_data(query=query,
+                                          params=params,
                                           dbsession=dbsession,
                                           response_schema=PaginatedResponseTemplate, 
                                           current_page=pagina, 
-                                          records_per_page=tamanho_da_pagina)
+                                          records_per_page=tamanho_da_pagina,
+                                          cursor=cursor,
+                                          include_total=incluir_total)
         return result
     
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=config.ERROR_MESSAGE_INTERNAL)
\ No newline at end of file
+                            detail=config.ERROR_MESSAGE_INTERNAL)
+
+
+@trf_router.get("/trf/export",
+                status_code=status.HTTP_200_OK,
+                description="Exporta em NDJSON, CSV, Arrow ou Parquet os dados de TRF - TED.",
+                response_description="Arquivo de TRFs - TED",
+                response_class=StreamingResponse
+                )
+async def exporta_trf_ted(
+    filtros: dict = Depends(filtros_trf.optional),
+    formato: FormatoExportacao = Query(FormatoExportacao.ndjson, description="Formato do Arquivo Exportado")
+):
+    query, params = filtros_trf.query(filtros)
+    return export_data(query=query, params=params, export_format=formato, file_name="trf")
@@ -8,10 +8,12 @@ class PaginatedResponseTemplate(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     
     data: List[Any]
-    total_pages: int
-    total_items: int
+    total_pages: Optional[int]
+    total_items: Optional[int]
+    total_items_exact: Optional[bool] = None
     page_number: int
     page_size: int
+    next_cursor: Optional[str] = None
 # --------------------------------------
 
 
@@ -80,7 +82,7 @@ class PlanoAcaoResponse(BaseModel):
 
 
 class PaginatedPlanoAcaoResponse(PaginatedResponseTemplate):
-    data: List[PlanoAcaoResponse]
+    data: List["PlanoAcaoExpandedResponse"]
  
 
 class PlanoAcaoAnaliseResponse(BaseModel):    
@@ -181,7 +183,7 @@ class ProgramaResponse(BaseModel):
 
 
 class PaginatedProgramaResponse(PaginatedResponseTemplate):
-    data: List[ProgramaResponse]
+    data: List["ProgramaExpandedResponse"]
  
 
 class ProgramaAcaoOrcamentariaResponse(BaseModel):  
@@ -259,4 +261,26 @@ class TrfResponse(BaseModel):
 
 
 class PaginatedTrfResponse(PaginatedResponseTemplate):
-    data: List[TrfResponse]
\ No newline at end of file
+    data: List[TrfResponse]
+
+
+# Relacionamentos incluidos pelo parametro expand
+class NotaCreditoExpandedResponse(NotaCreditoResponse):
+    eventos: Optional[List[EventoResponse]] = None
+
+
+class PlanoAcaoMetaExpandedResponse(PlanoAcaoMetaResponse):
+    etapas: Optional[List[PlanoAcaoEtapaResponse]] = None
+
+
+class PlanoAcaoExpandedResponse(PlanoAcaoResponse):
+    metas: Optional[List[PlanoAcaoMetaExpandedResponse]] = None
+    notas_credito: Optional[List[NotaCreditoExpandedResponse]] = None
+
+
+class ProgramaExpandedResponse(ProgramaResponse):
+    planos_acao: Optional[List[PlanoAcaoExpandedResponse]] = None
+
+
+PaginatedPlanoAcaoResponse.model_rebuild()
+PaginatedProgramaResponse.model_rebuild()
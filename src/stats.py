@@ -0,0 +1,283 @@
+# src/stats.py
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from src.cache import shared_store
+
+PATHS_KEY = "stats:endpoints"
+MONTHLY_KEY = "stats:monthly"
+COUNTERS_KEY = "stats:counters"
+WORKERS_KEY = "stats:workers"
+# Gauges of a worker that stopped flushing are dropped after this many seconds
+WORKER_TTL = 30
+# Per-minute counters only need to outlive the minute that reads them
+MINUTE_TTL = 120
+# Sub-buckets per power of two of the latency histograms, i.e. values are kept within ~6%
+SUB_BUCKET_BITS = 4
+PERCENTILES = (50, 95, 99)
+# Upper bounds, in seconds, of the latency buckets exposed to Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LATENCY_BUCKETS_US = tuple(int(bound * 1_000_000) for bound in LATENCY_BUCKETS)
+WORKER = str(os.getpid())
+
+# Increments recorded by this worker since the last flush, as {(hash key, field): amount},
+# besides the ones kept in the route slots and the month counts.
+# Recording has no await in between its updates, so it needs no lock
+pending = Counter()
+route_slots = {}
+month_counts = Counter()
+# Current value of the gauges of this worker, sent with every flush
+worker_gauges = {}
+# Last value seen of each cumulative counter of this worker, whose increments are added to the shared ones
+last_counters = {}
+store = None
+
+
+def endpoint_key(path: str) -> str:
+    return f"stats:endpoint:{path}"
+
+
+def minute_key(minute: int) -> str:
+    return f"stats:minute:{minute}"
+
+
+def latency_bucket(microseconds: int) -> int:
+    """
+    HDR-style bucket: exact below 2 * 2**SUB_BUCKET_BITS, then 2**SUB_BUCKET_BITS linear sub-buckets per power of two
+    """
+    if microseconds < 2 << SUB_BUCKET_BITS:
+        return microseconds
+    shift = microseconds.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift << SUB_BUCKET_BITS) + (microseconds >> shift)
+
+
+def bucket_value(bucket: int) -> float:
+    """
+    Midpoint, in microseconds, of the latencies that fall in the bucket
+    """
+    if bucket < 2 << SUB_BUCKET_BITS:
+        return bucket
+    shift = (bucket >> SUB_BUCKET_BITS) - 1
+    return ((bucket - (shift << SUB_BUCKET_BITS)) + 0.5) * (1 << shift)
+
+
+def percentiles(histogram: dict[int, int]) -> dict:
+    result = {f"p{p}": 0.0 for p in PERCENTILES}
+    total = sum(histogram.values())
+    targets = [(p, total * p / 100) for p in PERCENTILES]
+    seen = 0
+    for bucket, amount in sorted(histogram.items()):
+        seen += amount
+        while targets and seen >= targets[0][1]:
+            result[f"p{targets.pop(0)[0]}"] = bucket_value(bucket) / 1000
+    return result
+
+
+class RouteSlot:
+    """
+    Requests of one route in this worker since the last flush, allocated once per route
+    so that recording a request only adds to its counters
+    """
+    __slots__ = ("path", "key", "count", "total_us", "histogram", "latency_buckets", "minutes")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.key = endpoint_key(path)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_us = 0
+        self.histogram = Counter()
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.minutes = Counter()
+
+    def record(self, microseconds: int, minute: int):
+        self.count += 1
+        self.total_us += microseconds
+        self.histogram[latency_bucket(microseconds)] += 1
+        self.latency_buckets[bisect_left(LATENCY_BUCKETS_US, microseconds)] += 1
+        self.minutes[minute] += 1
+
+    def drain(self, batch: Counter):
+        if not self.count:
+            return
+        batch[(self.key, "count")] += self.count
+        batch[(self.key, "total_us")] += self.total_us
+        for bucket, amount in self.histogram.items():
+            batch[(self.key, f"b{bucket}")] += amount
+        for index, amount in enumerate(self.latency_buckets):
+            if amount:
+                batch[(self.key, f"le{index}")] += amount
+        for minute, amount in self.minutes.items():
+            batch[(minute_key(minute), self.path)] += amount
+        self.reset()
+
+
+def route_slot(path: str) -> RouteSlot:
+    slot = route_slots.get(path)
+    if slot is None:
+        slot = route_slots[path] = RouteSlot(path)
+    return slot
+
+
+def record_request(path: str, month: str, microseconds: int):
+    route_slot(path).record(microseconds, int(time.time() // 60))
+    month_counts[month] += 1
+
+
+def record_counters(counters: dict):
+    """
+    Adds to the shared counters what the cumulative counters of this worker grew since the last call
+    """
+    for name, value in counters.items():
+        pending[(COUNTERS_KEY, name)] += value - last_counters.get(name, 0)
+        last_counters[name] = value
+
+
+class LocalStatsStore:
+    """
+    Counters of this worker only
+    """
+    def __init__(self):
+        self.hashes = defaultdict(Counter)
+        self.gauges = {}
+
+    async def increment(self, batch: Counter):
+        for (key, field), amount in batch.items():
+            self.hashes[key][field] += amount
+        self.hashes.pop(minute_key(int(time.time() // 60) - 2), None)
+
+    async def paths(self) -> list[str]:
+        prefix = endpoint_key("")
+        return [key[len(prefix):] for key in self.hashes if key.startswith(prefix)]
+
+    async def read(self, keys: list[str]) -> list[dict]:
+        return [dict(self.hashes.get(key, {})) for key in keys]
+
+    async def set_gauges(self, worker: str, gauges: dict):
+        self.gauges[worker] = dict(gauges)
+
+    async def read_gauges(self) -> dict:
+        return self.gauges
+
+
+class RedisStatsStore:
+    """
+    Counters shared by every worker in Redis hashes, incremented with HINCRBY in one pipeline per flush
+    """
+    def __init__(self, client):
+        self.client = client
+
+    async def increment(self, batch: Counter):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for (key, field), amount in batch.items():
+                pipe.hincrby(key, field, amount)
+            keys = {key for key, _ in batch}
+            endpoints = [key[len(endpoint_key("")):] for key in keys if key.startswith(endpoint_key(""))]
+            if endpoints:
+                pipe.sadd(PATHS_KEY, *endpoints)
+            for key in keys:
+                if key.startswith(minute_key("")):
+                    pipe.expire(key, MINUTE_TTL)
+            await pipe.execute()
+
+    async def paths(self) -> list[str]:
+        return sorted(await self.client.smembers(PATHS_KEY))
+
+    async def read(self, keys: list[str]) -> list[dict]:
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            return await pipe.execute()
+
+    async def set_gauges(self, worker: str, gauges: dict):
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(f"{WORKERS_KEY}:{worker}", mapping=gauges)
+            pipe.expire(f"{WORKERS_KEY}:{worker}", WORKER_TTL)
+            pipe.sadd(WORKERS_KEY, worker)
+            await pipe.execute()
+
+    async def read_gauges(self) -> dict:
+        workers = sorted(await self.client.smembers(WORKERS_KEY))
+        gauges = await self.read([f"{WORKERS_KEY}:{worker}" for worker in workers])
+        stopped = [worker for worker, values in zip(workers, gauges) if not values]
+        if stopped:
+            await self.client.srem(WORKERS_KEY, *stopped)
+        return {worker: {name: float(value) for name, value in values.items()}
+                for worker, values in zip(workers, gauges) if values}
+
+
+def setup_stats(settings):
+    global store
+    store = shared_store(settings, LocalStatsStore, RedisStatsStore)
+
+
+async def flush_stats():
+    batch = pending.copy()
+    pending.clear()
+    for slot in route_slots.values():
+        slot.drain(batch)
+    for month, amount in month_counts.items():
+        batch[(MONTHLY_KEY, month)] += amount
+    month_counts.clear()
+    try:
+        if batch:
+            await store.increment(batch)
+    except Exception:
+        # Kept for the next flush
+        pending.update(batch)
+        raise
+    if worker_gauges:
+        await store.set_gauges(WORKER, worker_gauges)
+
+
+async def flush_stats_periodically(interval: float, logger, collect=None):
+    """
+    Sends the stats of this worker to the store every `interval` seconds, after `collect()` updates its counters and gauges
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if collect:
+                collect()
+            await flush_stats()
+        except Exception as e:
+            logger.warning(f"Não foi possível gravar as estatísticas: {str(e)}")
+
+
+async def read_stats() -> tuple[dict, dict]:
+    """
+    Returns the stats of every endpoint, with latency percentiles in ms, and the requests per month, across all workers
+    """
+    paths = await store.paths()
+    *endpoints, minute, monthly = await store.read(
+        [endpoint_key(path) for path in paths] + [minute_key(int(time.time() // 60)), MONTHLY_KEY]
+    )
+    stats = {}
+    for path, fields in zip(paths, endpoints):
+        count = int(fields.get("count", 0))
+        histogram = {int(field[1:]): int(amount) for field, amount in fields.items() if field.startswith("b")}
+        stats[path] = {
+            "count": count,
+            "total_time": int(fields.get("total_us", 0)) / 1_000_000,
+            "last_minute_count": int(minute.get(path, 0)),
+            "latency_buckets": [int(fields.get(f"le{i}", 0)) for i in range(len(LATENCY_BUCKETS) + 1)],
+            **percentiles(histogram),
+        }
+    return stats, {month: int(count) for month, count in monthly.items()}
+
+
+async def read_monthly_stats() -> dict:
+    return (await read_stats())[1]
+
+
+async def read_counters() -> dict:
+    counters, = await store.read([COUNTERS_KEY])
+    return {name: int(value) for name, value in counters.items()}
+
+
+async def read_gauges() -> dict:
+    return await store.read_gauges()
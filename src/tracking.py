@@ -0,0 +1,73 @@
+# src/tracking.py
+import datetime as dt
+import time
+from src.stats import record_request, route_slot
+from src.utils import RouteMatcher, UNKNOWN_PATH
+from src.warmup import WARMUP_HEADER, record_query
+
+# Months of the stats are counted in Brasília time
+STATS_TIMEZONE = dt.timezone(dt.timedelta(hours=-3))
+
+
+class MonthBucket:
+    """
+    Current "MM/YYYY" label, only recomputed once the month is over
+    """
+    def __init__(self):
+        self.label = None
+        self.until = 0.0
+
+    def current(self) -> str:
+        now = time.time()
+        if now >= self.until:
+            today = dt.datetime.fromtimestamp(now, tz=STATS_TIMEZONE)
+            self.label = today.strftime("%m/%Y")
+            next_month = (today.replace(day=28) + dt.timedelta(days=4)).replace(day=1, hour=0, minute=0,
+                                                                               second=0, microsecond=0)
+            self.until = next_month.timestamp()
+        return self.label
+
+
+class RequestTrackingMiddleware:
+    """
+    ASGI middleware that records the time of each request to a documented route, up to the start of its response.
+    The response messages are forwarded as they come, so streamed bodies are neither buffered nor delayed
+    """
+    def __init__(self, app, root_path: str = ""):
+        self.app = app
+        self.root_path = root_path
+        self.matcher = None
+        self.month = MonthBucket()
+        self.warmup_header = WARMUP_HEADER.encode()
+
+    def build_matcher(self, routes) -> RouteMatcher:
+        matcher = RouteMatcher(routes, root_path=self.root_path)
+        # Preallocates the stats of every route
+        for template in (*matcher.templates.values(), *(template for _, template in matcher.patterns), UNKNOWN_PATH):
+            route_slot(template)
+        return matcher
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.matcher is None:
+            self.matcher = self.build_matcher(scope["app"].routes)
+        path = self.matcher.match(scope["path"])
+        # Requests made by the cache warmer are not traffic
+        if path is None or any(name == self.warmup_header for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter_ns()
+
+        async def send_tracked(message):
+            if message["type"] == "http.response.start":
+                record_request(path, self.month.current(), (time.perf_counter_ns() - start) // 1000)
+                # Remember the query, to replay the most frequent ones when the cache is warmed
+                if message["status"] == 200 and scope["method"] == "GET" and scope["query_string"] \
+                        and path != UNKNOWN_PATH and not path.endswith("/export"):
+                    record_query(scope["path"], scope["query_string"].decode("latin-1"))
+            await send(message)
+
+        await self.app(scope, receive, send_tracked)
@@ -1,66 +1,185 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import AsyncGenerator
+from sqlalchemy import bindparam, inspect, tuple_, BigInteger, Integer
+from typing import AsyncGenerator, Optional
 from sqlmodel import select, func
 from math import ceil
 import asyncio
+import base64
+import orjson
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi import Depends, HTTPException, status
 import secrets
 from appconfig import Settings
+from src.counts import (
+    cached_count,
+    count_strategy,
+    estimate_count,
+    exact_count,
+    exact_count_in_new_session,
+    store_count
+)
+from src.expand import load_expansions
+from src.filters import template_cache
 
 security_stats = HTTPBasic()
 config = Settings()
 
-# Dependency to inject db sessions
+# Dependency to inject db sessions. The routes only read, so they are sent to the replicas when there are any
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     from main import db
-    async for session in db.get_db_session():
+    async for session in db.get_read_session():
         yield session
 
 
-async def get_paginated_data(query: select, dbsession: AsyncSession, response_schema, current_page: int = 1, records_per_page: int = 10):
-    # Prepare the query for execution
-    query.execution_options(prepared=True)
-    # Calculate the offset based on the current page and records per page
-    offset = (current_page - 1) * records_per_page
+def encode_cursor(values: list) -> str:
+    """
+    Encodes the primary key values of the last row of a page into an opaque cursor
+    """
+    return base64.urlsafe_b64encode(orjson.dumps(values)).rstrip(b"=").decode()
+
+
+def cursor_value_matches(value, column) -> bool:
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        # sqlmodel's AutoString doesn't report its python type
+        python_type = str
+    if isinstance(value, bool) or not isinstance(value, python_type):
+        return False
+    if isinstance(column.type, Integer) and not isinstance(column.type, BigInteger):
+        # Out of the range of a Postgres integer the driver would fail on execution
+        return -2**31 <= value < 2**31
+    return True
+
+
+def decode_cursor(cursor: str, pk_columns) -> list:
+    """
+    Decodes a cursor produced by encode_cursor, validating the number and the types of the key values
+    """
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != len(pk_columns) \
+            or not all(cursor_value_matches(value, column) for value, column in zip(values, pk_columns)):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=config.ERROR_MESSAGE_INVALID_CURSOR)
+    return values
+
 
-    # Query total number of records
-    count_query = select(func.count()).select_from(query.subquery())
-    total_records = await dbsession.scalar(count_query)
+# Column added to the page by the window count strategy
+WINDOW_TOTAL = "__total_count"
 
-    # Calculate the last page number
-    last_page = ceil(total_records / records_per_page)
 
-    # Query items using the calculated offset and records per page
-    items_query = query.offset(offset).limit(records_per_page)
-    result = await dbsession.execute(items_query)            
-    items = result.scalars().all()    
+# Pages by offset, by cursor and with a window count
+@template_cache(variants=3)
+def page_statement(query: select, keyset: bool, window_total: bool = False) -> select:
+    """
+    Derives from the filtered query the statement that fetches one page, with offset, limit and
+    cursor values as bound parameters so it is built once per query and reused.
+    With window_total each row also carries the total count of the query, computed before the limit
+    """
+    mapper = inspect(query.column_descriptions[0]["entity"])
+    # Primary key columns give the pages a stable order and back the keyset cursor
+    pk_columns = mapper.primary_key
+    # Plain table columns are selected so rows come back as mappings in a single
+    # round-trip, without going through the ORM identity map
+    page_query = query.with_only_columns(*mapper.local_table.columns)
+    if window_total:
+        page_query = page_query.add_columns(func.count().over().label(WINDOW_TOTAL))
+    if keyset:
+        # Keyset pagination: seek past the last key seen, so deep pages cost the same as the first one
+        last_key = [bindparam(f"cursor_{i}", type_=col.type) for i, col in enumerate(pk_columns)]
+        page_query = page_query.where(tuple_(*pk_columns) > tuple_(*last_key))
+    else:
+        page_query = page_query.offset(bindparam("page_offset", type_=Integer))
+    return page_query.order_by(*pk_columns).limit(bindparam("page_limit", type_=Integer))
+
+
+async def get_paginated_data(query: select, dbsession: AsyncSession, response_schema, current_page: int = 1, records_per_page: int = 10, cursor: Optional[str] = None, include_total: bool = True, params: Optional[dict] = None, expand: Optional[dict] = None):
+    params = params or {}
+    model = query.column_descriptions[0]["entity"]
+    pk_columns = inspect(model).primary_key
+
+    # Decode the cursor before touching the database, so a bad cursor is rejected upfront
+    last_key = decode_cursor(cursor, pk_columns) if cursor else None
+
+    # Total number of records (cached or estimated), unless the client opted out.
+    # Exact counts that are not cached are fetched along with the page, as picked by count_strategy
+    total_records, total_is_exact, last_page = None, None, None
+    strategy, count_task = None, None
+    if include_total:
+        count_key, total_records = await cached_count(query, params)
+        total_is_exact = total_records is not None
+        if total_records is None:
+            estimate = await estimate_count(query, params, dbsession)
+            if estimate is not None and estimate >= config.COUNT_ESTIMATE_THRESHOLD:
+                total_records = estimate
+            else:
+                total_is_exact = True
+                strategy = count_strategy(estimate, last_key is not None)
+                if strategy == "sequential":
+                    total_records = await exact_count(query, params, dbsession, count_key)
+                elif strategy == "concurrent":
+                    count_task = asyncio.create_task(exact_count_in_new_session(query, params, dbsession, count_key))
+
+    page_params = {**params, "page_limit": records_per_page}
+    if last_key is not None:
+        page_params.update({f"cursor_{i}": value for i, value in enumerate(last_key)})
+    else:
+        # Calculate the offset based on the current page and records per page
+        page_params["page_offset"] = (current_page - 1) * records_per_page
 
-    for item in items:
-        await dbsession.refresh(item)
+    try:
+        # Query items using the calculated offset (or cursor) and records per page
+        result = await dbsession.execute(page_statement(query, last_key is not None, strategy == "window"),
+                                         page_params)
+        items = [dict(row) for row in result.mappings()]
+        if count_task is not None:
+            total_records = await count_task
+    finally:
+        if count_task is not None and not count_task.done():
+            count_task.cancel()
+
+    if strategy == "window":
+        for item in items:
+            total_records = item.pop(WINDOW_TOTAL)
+        if items or current_page == 1:
+            total_records = total_records or 0
+            await store_count(query, count_key, total_records)
+        else:
+            # Past the last page no row carries the total
+            total_records = await exact_count(query, params, dbsession, count_key)
+    if include_total:
+        # Calculate the last page number
+        last_page = ceil(total_records / records_per_page)
+
+    if expand:
+        # Related resources requested through the expand parameter, loaded in batch for the whole page
+        await load_expansions(dbsession, model, items, expand)
+
+    next_cursor = None
+    if len(items) == records_per_page:
+        next_cursor = encode_cursor([items[-1][col.key] for col in pk_columns])
           
     return response_schema(
             data=items,
             total_pages=last_page,
             total_items=total_records,
+            total_items_exact=total_is_exact,
             page_number=current_page,
-            page_size=min(len(items), total_records)
+            page_size=len(items),
+            next_cursor=next_cursor
         )
 
 
-async def reset_minute_counters(request_stats:dict):
-    while True:
-        await asyncio.sleep(60)
-        for stats in request_stats.values():
-            stats["last_minute_count"] = 0
-
-
-async def save_stats(request_stats:dict):
+async def save_stats(read_monthly_stats):
     import pickle
     while True:
         await asyncio.sleep(7200)
+        monthly_stats = await read_monthly_stats()
         with open('monthly_request_stats.pkl', 'wb') as f:
-            pickle.dump(request_stats, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(monthly_stats, f, pickle.HIGHEST_PROTOCOL)
 
 
 def verify_admin(credentials: HTTPBasicCredentials = Depends(security_stats)):
@@ -75,33 +194,46 @@ def verify_admin(credentials: HTTPBasicCredentials = Depends(security_stats)):
     return credentials.username
 
 
-async def get_allowed_stats_paths(root_path:str, logger, wait_time=10):
+# Stats bucket of the requests to paths that match no route, such as scanners and 404s
+UNKNOWN_PATH = "(outros)"
+
+
+class RouteMatcher:
     """
-    Function to get allowed paths from OpenAPI schema
+    Maps a request path to the template of the documented route it hits, built once from the app routes.
+    Undocumented routes (docs, stats, static files) map to None and are not tracked; any other path maps
+    to UNKNOWN_PATH, so the stats hold one entry per route at most
     """
-    import httpx
-    import socket
-    try:
-        # Wait a bit for the server to start
-        await asyncio.sleep(wait_time)
-        # Dynamically determine the base URL;        
-        hostname = socket.gethostbyname(socket.gethostname())
-        base_url = f"http://{hostname}:8000"
-        
-        openapi_url = f"{base_url}{root_path}/openapi.json"
-        logger.info(f"Fetching OpenAPI schema from: {openapi_url}")
-        
-        # Set a timeout for the request
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(openapi_url)
-            paths = list(response.json()['paths'].keys())
-            logger.info(f"Retrieved {len(paths)} paths from OpenAPI schema")
-            fmt_paths = [root_path + p for p in paths]
-            return fmt_paths
-    except httpx.TimeoutException:
-        logger.error("Timeout while getting OpenAPI paths")
-        return []
-    except Exception as e:
-        logger.error(f"Error getting OpenAPI paths: {e.__repr__()}")
-        # Return a minimal set of paths as fallback
-        return []
\ No newline at end of file
+    def __init__(self, routes: list, root_path: str):
+        from fastapi.routing import APIRoute
+        from starlette.routing import Mount
+        self.root_path = root_path
+        # Exact paths, with and without the root path, for the O(1) lookup of routes without parameters
+        self.templates = {}
+        self.patterns = []
+        self.ignored = set()
+        self.ignored_prefixes = []
+        for route in routes:
+            if isinstance(route, Mount):
+                self.ignored_prefixes.extend((route.path + "/", root_path + route.path + "/"))
+            elif isinstance(route, APIRoute) and route.include_in_schema:
+                template = root_path + route.path_format
+                if route.param_convertors:
+                    self.patterns.append((route.path_regex, template))
+                else:
+                    self.templates[route.path] = self.templates[root_path + route.path] = template
+            else:
+                self.ignored.update((route.path, root_path + route.path))
+        self.ignored_prefixes = tuple(self.ignored_prefixes)
+
+    def match(self, path: str) -> Optional[str]:
+        template = self.templates.get(path)
+        if template is not None:
+            return template
+        if path in self.ignored or path.startswith(self.ignored_prefixes):
+            return None
+        route_path = path.removeprefix(self.root_path)
+        for regex, template in self.patterns:
+            if regex.match(route_path):
+                return template
+        return UNKNOWN_PATH
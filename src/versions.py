@@ -0,0 +1,73 @@
+# src/versions.py
+import asyncio
+from sqlalchemy import text
+from cashews import cache
+from src.models import db_schema
+from appconfig import Settings
+
+config = Settings()
+
+# Current data version of each table, part of every cache key that depends on it
+data_versions = {}
+# WAL position of the primary when the current versions were read. A replica that has not replayed
+# up to it may still hold the data of the previous versions
+data_lsn = 0
+# Set when the versions are first read and whenever they change, so the cache can be warmed again
+data_changed = asyncio.Event()
+
+
+def data_tag(table: str) -> str:
+    return f"data:{table}"
+
+
+def data_version(*tables: str) -> str:
+    return ".".join(data_versions.get(table, "") for table in tables)
+
+
+async def read_data_versions(db) -> tuple[dict, int]:
+    """
+    Reads a version per table from the cumulative row change counters of pg_stat_user_tables,
+    which move with every load, so no change to the ETL is needed.
+    The counters start again from zero when a table is dropped and created again, so the table OID,
+    which is new each time, is part of the version.
+    Always read on the primary: a replica keeps its own counters, which replay does not move.
+    Also returns the current WAL position of the primary
+    """
+    async with db.async_session_maker() as session:
+        result = await session.execute(
+            text("SELECT relname, relid, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables "
+                 "WHERE schemaname = :schema"),
+            {"schema": db_schema}
+        )
+        versions = {table: f"{oid}-{changes}" for table, oid, changes in result}
+        lsn = await session.scalar(text("SELECT (pg_current_wal_lsn() - '0/0'::pg_lsn)::bigint"))
+        return versions, lsn
+
+
+async def watch_data_versions(db, logger):
+    """
+    Polls the data versions. When a table changes, the new version moves its readers to new cache keys
+    and the entries tagged with the table are dropped.
+    Reads only go to the replicas that have replayed the WAL up to the new versions, so the new keys
+    are not filled with the data of the previous load
+    """
+    global data_lsn
+    while True:
+        try:
+            versions, lsn = await read_data_versions(db)
+            first_read = not data_versions
+            changed = [table for table, version in versions.items()
+                       if table in data_versions and data_versions[table] != version]
+            if first_read or changed:
+                data_lsn = lsn
+                # Finds out without waiting for the next check which replicas already replayed the load
+                await db.check_replicas(config.REPLICA_MAX_LAG)
+            data_versions.update(versions)
+            if changed:
+                logger.info(f"Dados atualizados nas tabelas: {', '.join(changed)}")
+                await cache.delete_tags(*(data_tag(table) for table in changed))
+            if first_read or changed:
+                data_changed.set()
+        except Exception as e:
+            logger.warning(f"Não foi possível ler a versão dos dados: {str(e)}")
+        await asyncio.sleep(config.DATA_VERSION_INTERVAL)
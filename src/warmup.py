@@ -0,0 +1,171 @@
+# src/warmup.py
+import asyncio
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl, urlencode
+import httpx
+from cashews import cache
+from src.cache import shared_store
+from src.versions import data_changed
+from appconfig import Settings
+
+config = Settings()
+
+WARMUP_HEADER = "x-cache-warmup"
+PATHS_KEY = "warmup:paths"
+LOCK_KEY = "warmup:lock"
+DECAY_LOCK_KEY = "warmup:decay"
+
+# Requests per normalized query string of each endpoint, in this worker since the last save
+query_signatures = defaultdict(Counter)
+store = None
+
+
+def signatures_key(path: str) -> str:
+    return f"warmup:signatures:{path}"
+
+
+def normalize_query(query: str) -> str:
+    return urlencode(sorted((name, value) for name, value in parse_qsl(query) if value))
+
+
+def record_query(path: str, query: str):
+    signatures = query_signatures[path]
+    signatures[normalize_query(query)] += 1
+    # Bounds the memory used by long tails of one-off queries
+    if len(signatures) > config.WARMUP_TOP_N * 10:
+        query_signatures[path] = Counter(dict(signatures.most_common(config.WARMUP_TOP_N)))
+
+
+class LocalSignatureStore:
+    """
+    Counts of this worker only
+    """
+    def __init__(self):
+        self.signatures = defaultdict(Counter)
+
+    async def add(self, counts: dict, keep: int):
+        for path, signatures in counts.items():
+            stored = self.signatures[path]
+            stored.update(signatures)
+            if len(stored) > keep:
+                self.signatures[path] = Counter(dict(stored.most_common(keep)))
+
+    async def decay(self, factor: float):
+        for path, stored in self.signatures.items():
+            self.signatures[path] = Counter({query: count * factor for query, count in stored.items()})
+
+    async def top(self, amount: int) -> dict[str, list[str]]:
+        return {path: [query for query, _ in stored.most_common(amount)] for path, stored in self.signatures.items()}
+
+
+class RedisSignatureStore:
+    """
+    Counts shared by every worker in a Redis sorted set per endpoint. ZINCRBY adds to the stored scores,
+    so saves of several workers at the same time don't overwrite each other
+    """
+    def __init__(self, client):
+        self.client = client
+
+    async def add(self, counts: dict, keep: int):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for path, signatures in counts.items():
+                key = signatures_key(path)
+                for query, amount in signatures.items():
+                    pipe.zincrby(key, amount, query)
+                # Drops the long tail, past the `keep` highest scores
+                pipe.zremrangebyrank(key, 0, -keep - 1)
+            pipe.sadd(PATHS_KEY, *counts)
+            await pipe.execute()
+
+    async def paths(self) -> list[str]:
+        return sorted(await self.client.smembers(PATHS_KEY))
+
+    async def decay(self, factor: float):
+        paths = await self.paths()
+        async with self.client.pipeline(transaction=False) as pipe:
+            for path in paths:
+                pipe.zunionstore(signatures_key(path), {signatures_key(path): factor})
+            await pipe.execute()
+
+    async def top(self, amount: int) -> dict[str, list[str]]:
+        paths = await self.paths()
+        async with self.client.pipeline(transaction=False) as pipe:
+            for path in paths:
+                pipe.zrevrange(signatures_key(path), 0, amount - 1)
+            return dict(zip(paths, await pipe.execute()))
+
+
+def setup_warmup(settings):
+    global store
+    store = shared_store(settings, LocalSignatureStore, RedisSignatureStore)
+
+
+async def save_signatures():
+    """
+    Adds the counts of this worker to the shared counts of each endpoint, kept in the cache server
+    so they survive restarts
+    """
+    counts = dict(query_signatures)
+    query_signatures.clear()
+    try:
+        if counts:
+            await store.add(counts, config.WARMUP_TOP_N * 10)
+    except Exception:
+        # Kept for the next save
+        for path, signatures in counts.items():
+            query_signatures[path].update(signatures)
+        raise
+    # Older counts fade, so the top follows the recent traffic. The lock is never released,
+    # so a single worker decays them once per interval
+    if await cache.set_lock(DECAY_LOCK_KEY, "1", expire=config.WARMUP_DECAY_INTERVAL):
+        await store.decay(config.WARMUP_DECAY)
+
+
+async def replay(app, logger):
+    """
+    Requests the most frequent queries of each endpoint through the app itself, filling the cache.
+    Only one worker replays at a time, with at most WARMUP_CONCURRENCY requests in flight
+    """
+    if not await cache.set_lock(LOCK_KEY, "1", expire=config.WARMUP_LOCK_TTL):
+        return
+    try:
+        top = await store.top(config.WARMUP_TOP_N)
+        urls = [f"{path}?{query}" for path, queries in top.items() for query in queries]
+        semaphore = asyncio.Semaphore(config.WARMUP_CONCURRENCY)
+
+        async def warm(client, url):
+            async with semaphore:
+                try:
+                    await client.get(url)
+                except Exception as e:
+                    logger.warning(f"Falha no aquecimento do cache em {url}: {str(e)}")
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://warmup",
+                                     headers={WARMUP_HEADER: "1"}, timeout=None) as client:
+            await asyncio.gather(*(warm(client, url) for url in urls))
+        logger.info(f"Cache aquecido com {len(urls)} consultas")
+    finally:
+        await cache.unlock(LOCK_KEY, "1")
+
+
+async def warm_cache(app, logger):
+    """
+    Replays the top queries whenever the data versions are loaded or change: after startup and after each load
+    """
+    while True:
+        await data_changed.wait()
+        data_changed.clear()
+        try:
+            await replay(app, logger)
+        except Exception as e:
+            logger.warning(f"Não foi possível aquecer o cache: {str(e)}")
+
+
+async def save_signatures_periodically(logger):
+    while True:
+        await asyncio.sleep(config.WARMUP_SAVE_INTERVAL)
+        try:
+            await save_signatures()
+        except Exception as e:
+            logger.warning(f"Não foi possível salvar as consultas mais frequentes: {str(e)}")
@@ -0,0 +1,20 @@
+# tests/test_cache_keys.py
+from cashews.key import default_format
+from src.cache import page_key
+
+PAGE_PARAMS = {"data_version": "1-2", "pagina": 1, "tamanho_da_pagina": 10, "cursor": None, "incluir_total": True,
+               "expand": {}}
+
+
+def key_for(filtros: dict) -> str:
+    return default_format(page_key("programa", ("expand",)), filtros=filtros, **PAGE_PARAMS)
+
+
+def test_separators_in_filter_values_do_not_collide():
+    assert key_for({"tx_nome_programa": "saude:tx_situacao_programa:ativo"}) \
+        != key_for({"tx_nome_programa": "saude", "tx_situacao_programa": "ativo"})
+
+
+def test_filter_order_does_not_change_the_key():
+    assert key_for({"tx_nome_programa": "saude", "tx_situacao_programa": "ativo"}) \
+        == key_for({"tx_situacao_programa": "ativo", "tx_nome_programa": "saude"})
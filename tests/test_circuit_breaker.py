@@ -0,0 +1,49 @@
+# tests/test_circuit_breaker.py
+import asyncio
+import pytest
+from cashews.commands import Command
+from src.cache import CircuitBreaker
+
+
+def open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(fallback_size=10, window=4, min_calls=1, error_rate=0.5,
+                             slow_call=1.0, timeout=0.2, cooldown=0.0)
+    breaker.open()
+    return breaker
+
+
+async def healthy(*args, **kwargs):
+    return "redis"
+
+
+async def hanging(*args, **kwargs):
+    await asyncio.sleep(10)
+
+
+@pytest.mark.anyio
+async def test_cancelled_probe_opens_the_breaker_again():
+    breaker = open_breaker()
+    probe = asyncio.create_task(breaker(hanging, Command.GET, None, "key"))
+    await asyncio.sleep(0.01)
+    assert breaker.state == "half_open"
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+    assert breaker.state == "open"
+    assert await breaker(healthy, Command.GET, None, "key") == "redis"
+    assert breaker.state == "closed"
+
+
+@pytest.mark.anyio
+async def test_probe_past_its_deadline_gives_way_to_a_new_one():
+    breaker = open_breaker()
+    breaker.state, breaker.probe_started = "half_open", 0.0
+    assert await breaker(healthy, Command.GET, None, "key") == "redis"
+    assert breaker.state == "closed"
+
+
+@pytest.mark.anyio
+async def test_failed_probe_uses_the_fallback():
+    breaker = open_breaker()
+    assert await breaker(hanging, Command.GET, None, "key") is None
+    assert breaker.state == "open"
@@ -0,0 +1,61 @@
+# tests/test_pagination.py
+import pytest
+from src import models
+from src.counts import Explain
+from src.routers.nota_credito import filtros_nota_credito
+from src.schemas import PaginatedResponseTemplate
+from src.utils import WINDOW_TOTAL, get_paginated_data
+
+TOTAL_ROWS = 500
+
+
+class CountingSession:
+    """
+    Stands in for the AsyncSession of a route, recording each statement sent to the database.
+    It has no refresh, so loading the rows one by one fails
+    """
+    def __init__(self):
+        self.statements = []
+        self.rows = [{column.key: None for column in models.NotaCredito.__table__.columns} | {"id_nota": i}
+                     for i in range(TOTAL_ROWS)]
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement)
+        window = WINDOW_TOTAL in statement.selected_columns
+        rows = self.rows[params["page_offset"]:params["page_offset"] + params["page_limit"]]
+        return Result([row | {WINDOW_TOTAL: TOTAL_ROWS} if window else row for row in rows])
+
+    async def scalar(self, statement, params=None):
+        # Row estimates and counts
+        self.statements.append(statement)
+        if isinstance(statement, Explain):
+            return [{"Plan": {"Plan Rows": TOTAL_ROWS}}]
+        return TOTAL_ROWS
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def mappings(self):
+        return self.rows
+
+
+async def statements_for_page(filtros: dict, page_size: int, include_total: bool) -> int:
+    query, params = filtros_nota_credito.query(filtros)
+    session = CountingSession()
+    result = await get_paginated_data(query=query, params=params, dbsession=session,
+                                      response_schema=PaginatedResponseTemplate,
+                                      records_per_page=page_size, include_total=include_total)
+    assert result.page_size == page_size
+    return len(session.statements)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("filtros", [{}, {"tx_situacao_nota": "emitida"}])
+async def test_page_runs_a_fixed_number_of_statements(memory_cache, filtros):
+    assert await statements_for_page(filtros, 200, include_total=False) == 1
+    # Row estimate and page (with the count in a window)
+    counted = [await statements_for_page({**filtros, "tx_minuta_nota": str(page_size)}, page_size, include_total=True)
+               for page_size in (1, 10, 200)]
+    assert counted == [2, 2, 2]